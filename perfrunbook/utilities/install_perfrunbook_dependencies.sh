@@ -10,7 +10,7 @@ PERFRUNBOOK_VENV="/opt/perfrunbook-venv"
 install_python_dependencies () {
   python3 -m venv "${PERFRUNBOOK_VENV}"
   "${PERFRUNBOOK_VENV}/bin/pip" install --upgrade pip
-  "${PERFRUNBOOK_VENV}/bin/pip" install pandas numpy scipy matplotlib sh seaborn plotext
+  "${PERFRUNBOOK_VENV}/bin/pip" install pandas numpy scipy pyarrow matplotlib sh seaborn plotext
 }
 
 install_al2023_dependencies () {
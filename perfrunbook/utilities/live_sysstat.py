@@ -0,0 +1,150 @@
+#!/opt/perfrunbook-venv/bin/python3
+
+import argparse
+import asyncio
+import codecs
+import collections
+import os
+import shutil
+import numpy as np
+import pandas as pd
+
+from mpstat_parse import MpstatStatisticsDecoder, irq_totals, parse_mpstat_json_irq_matrix, parse_time
+from sar_parse import SECTION_PARSERS, SectionDispatcher, parse_start_date
+
+# Runs sar and mpstat for the length of a measurement and parses their records as they
+# are printed instead of once the tools exit.  Records are kept in one ring buffer per
+# sar section, plus "irq" for mpstat, holding the most recent rows only, so plots and
+# stats can be refreshed from them while a load test is running.
+
+# Activities sar reports live, the sections plot_cpu, plot_tcp and plot_cswitch use
+SAR_ARGS = ["-u", "ALL", "-n", "TCP", "-w"]
+
+# Rows kept per section, e.g. a bit over an hour of 1 s samples of 24 rows each
+RING_ROWS = 100000
+
+
+class RingBuffer(object):
+    """
+    Holds the last capacity rows published to it
+    """
+
+    def __init__(self, capacity=RING_ROWS):
+        self.rows = collections.deque(maxlen=capacity)
+
+    def extend(self, rows):
+        self.rows.extend(rows)
+
+    def __len__(self):
+        return len(self.rows)
+
+    # Data frame of the rows held, indexed by time like the parsed frames
+    def frame(self):
+        df = pd.DataFrame(list(self.rows))
+        if 'time' in df.columns:
+            df = df.set_index('time')
+        return df
+
+
+class LiveCollector(object):
+    """
+    Publishes the records of sar and mpstat to ring buffers as the tools print them
+    """
+
+    def __init__(self, capacity=RING_ROWS):
+        self.rings = collections.defaultdict(lambda: RingBuffer(capacity))
+
+    # Data frame of the rows a section holds right now
+    def frame(self, name):
+        return self.rings[name].frame()
+
+    async def spawn(self, cmd):
+        env = dict(os.environ, S_TIME_FORMAT="ISO", LC_TIME="ISO")
+        # sysstat tools block buffer stdout when it is a pipe, ask for line buffering
+        if shutil.which("stdbuf"):
+            cmd = ["stdbuf", "-oL"] + cmd
+        return await asyncio.create_subprocess_exec(*cmd, env=env, stdout=asyncio.subprocess.PIPE,
+                                                    stderr=asyncio.subprocess.DEVNULL)
+
+    def publish(self, parsers):
+        for parser in parsers:
+            if parser.lines or parser.frames:
+                df = parser.parse_pending()
+                parser.reset()
+                self.rings[parser.name].extend(df.reset_index().to_dict('records'))
+
+    async def sar(self, time, interval=1, args=SAR_ARGS):
+        """
+        Run sar for time seconds, parsing each interval's sections as they are printed
+        """
+        proc = await self.spawn(["sar"] + list(args) + [str(interval), str(max(1, time // interval))])
+        parsers = []
+        dispatcher = None
+        async for line in proc.stdout:
+            line = line.decode('utf-8')
+            if dispatcher is None:
+                start_date = parse_start_date(line)
+                if start_date:
+                    parsers = [cls(start_date) for cls in SECTION_PARSERS]
+                    dispatcher = SectionDispatcher(parsers)
+                continue
+
+            dispatcher.feed(line)
+            # Blank lines end the sections of an interval
+            if not line.strip():
+                self.publish(parsers)
+        self.publish(parsers)
+        return await proc.wait()
+
+    async def mpstat(self, time, interval=1):
+        """
+        Run mpstat -I ALL for time seconds, publishing the rate of all interrupts in
+        irq_s and the rate of every IRQ summed over the CPUs as each sample is printed
+        """
+        proc = await self.spawn(["mpstat", "-I", "ALL", "-o", "JSON", str(interval), str(max(1, time // interval))])
+        text = codecs.getincrementaldecoder('utf-8')()
+        decoder = MpstatStatisticsDecoder()
+        last_date = None
+        while True:
+            chunk = await proc.stdout.read(1 << 16)
+            if not chunk:
+                break
+            entries = decoder.feed(text.decode(chunk))
+            if not entries:
+                continue
+
+            # Sum every IRQ over the CPUs the same way parse_mpstat_json_single_irq does
+            times, cpus, names, matrix = parse_mpstat_json_irq_matrix(entries)
+            rows = []
+            for (date, stats), totals in zip(entries, irq_totals(matrix).tolist()):
+                if last_date is None:
+                    last_date = np.datetime64(f"{date} {stats['timestamp']}")
+                else:
+                    last_date = parse_time(stats["timestamp"], last_date)
+
+                row = dict(zip(names, totals), time=last_date, irq_s=float(stats["sum-interrupts"][0]["intr"]))
+                rows.append(row)
+            self.rings["irq"].extend(rows)
+        decoder.close()
+        return await proc.wait()
+
+
+async def print_live(collector, name, stat, time, refresh=1):
+    task = asyncio.ensure_future(collector.sar(time) if name != "irq" else collector.mpstat(time))
+    while not task.done():
+        await asyncio.sleep(refresh)
+        df = collector.frame(name)
+        if stat in df.columns:
+            print(df[stat].tail(1).to_string(header=False))
+    return await task
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--section", default="cpu", type=str,
+                        help="sar section to print, e.g. cpu, tcp, cswch, or irq for mpstat")
+    parser.add_argument("--stat", default="usr", type=str, help="Column of the section to print")
+    parser.add_argument("--time", default=60, type=int, help="How long to measure for in seconds")
+    args = parser.parse_args()
+
+    exit(asyncio.run(print_live(LiveCollector(), args.section, args.stat, args.time)))
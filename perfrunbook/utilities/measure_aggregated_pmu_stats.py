@@ -8,14 +8,22 @@ import json
 import math
 import os
 import re
+import resource
 import signal
 import subprocess
+import sys
+import threading
+import time
+import warnings
 from collections import defaultdict, namedtuple
 
 import numpy as np
 import pandas as pd
+import pyarrow as pa
 from scipy import stats
 
+from perf_event import EventGroup, parse_events
+from quantile_sketch import DEFAULT_RELATIVE_ACCURACY, DDSketch, summarize
 
 # When calculating aggregate stats, if some are zero, may
 # get a benign divide-by-zero warning from numpy, make it silent.
@@ -23,8 +31,30 @@ np.seterr(divide="ignore")
 
 # Constants
 SAMPLE_INTERVAL = 5
-RESULTS_CSV = "/tmp/stats.csv"
+RESULTS_ARROW = "/tmp/stats.arrow"
 RESULTS_JSON = "/tmp/stats.json"
+RESULTS_BREAKDOWN_JSON = "/tmp/stats_breakdown.json"
+CPU_SYSFS = "/sys/devices/system/cpu"
+NMI_WATCHDOG = "/proc/sys/kernel/nmi_watchdog"
+# Confidence level of the intervals reported for every stat
+CONFIDENCE = 0.95
+# Percentiles reported for every stat
+STAT_PERCENTILES = {"p10": 10, "p50": 50, "p90": 90, "p95": 95, "p99": 99, "p99.9": 99.9, "p100": 100}
+# Windows every stat has to be measured in before --converge can stop the measurement
+MIN_CONVERGE_WINDOWS = 10
+# Rows of measurements processed at a time
+COUNTER_CHUNK_ROWS = 1 << 20
+# Significance level of the differences compare reports
+COMPARE_ALPHA = 0.05
+# Stats that are better when higher, and a pattern of those better when lower, for
+# compare to tell a regression from an improvement.  Other stats, like instruction
+# mixes and bandwidths, describe the workload rather than how well it runs.
+HIGHER_IS_BETTER = {"ipc"}
+LOWER_IS_BETTER = re.compile(r"mpki|-pki$|stall|-rate$|-pka$")
+# Modified z-score past which a CPU, node or socket is flagged as an outlier
+OUTLIER_Z_SCORE = 3.5
+# Samples of a stat a CPU, node or socket needs to be scored for outliers
+OUTLIER_MIN_SAMPLES = 30
 
 
 # Classes
@@ -50,6 +80,105 @@ class SignalWatcher:
         signal.signal(signal.SIGALRM, signal.SIG_DFL)
 
 
+class CounterWriter:
+    """
+    Writes the measurements of every PMU to an Arrow IPC stream as typed columns, one
+    record batch per group and interval.  count is what was counted, frac the percent
+    of the interval the event was running for.  Counter and group names are replaced by
+    ids, the names of the counter ids are kept in the schema metadata.  Every batch is
+    also handed to the monitor, if any.
+    """
+
+    schema = pa.schema([
+        ("time", pa.float64()),
+        ("CPU", pa.int16()),
+        ("group", pa.int32()),
+        ("counter", pa.int32()),
+        ("count", pa.float64()),
+        ("frac", pa.float32()),
+    ])
+
+    def __init__(self, path, counter_groups, monitor=None):
+        names = sorted({ctr.get_canonical_name()
+                        for counter_sets in counter_groups.values()
+                        for ctrset in counter_sets
+                        for ctr in ctrset})
+        counter_ids = {name: i for i, name in enumerate(names)}
+
+        # perf names events <group>-<counter>, look up both ids at once
+        self.event_ids = {}
+        for named in name_groups(counter_groups).values():
+            for group, ctrset in named:
+                for ctr in ctrset:
+                    name = ctr.get_canonical_name()
+                    self.event_ids[f"{group}-{name}"] = (int(group[len("group"):]), counter_ids[name])
+
+        self.names = names
+        self.monitor = monitor
+        self.lock = threading.Lock()
+        self.sink = pa.OSFile(path, "wb")
+        self.writer = pa.ipc.new_stream(self.sink, self.schema.with_metadata({"counters": json.dumps(names)}))
+
+    def write(self, times, cpus, events, counts, fracs):
+        ids = np.array([self.event_ids[event] for event in events], dtype=np.int32).reshape(-1, 2)
+        batch = pa.record_batch([
+            pa.array(times, pa.float64()),
+            pa.array(cpus, pa.int16()),
+            pa.array(ids[:, 0]),
+            pa.array(ids[:, 1]),
+            pa.array(counts, pa.float64()),
+            pa.array(fracs, pa.float32()),
+        ], schema=self.schema)
+        with self.lock:
+            self.writer.write_batch(batch)
+            if self.monitor:
+                self.monitor.update(counters_frame(batch, self.names))
+
+    def close(self):
+        self.writer.close()
+        self.sink.close()
+
+
+def read_counters(path):
+    """
+    Memory maps the Arrow IPC stream CounterWriter wrote, returns a data frame of its
+    columns with the counter names as a categorical counter column
+    """
+    table = pa.ipc.open_stream(pa.memory_map(path)).read_all()
+    return counters_frame(table, json.loads(table.schema.metadata[b"counters"]))
+
+
+def iter_counters(path, chunk_rows=COUNTER_CHUNK_ROWS):
+    """
+    Yields the rows of the Arrow IPC stream CounterWriter wrote like read_counters does,
+    chunk_rows or a little more at a time.  Batches are never split, so each group
+    interval is in one chunk.
+    """
+    reader = pa.ipc.open_stream(pa.memory_map(path))
+    names = json.loads(reader.schema.metadata[b"counters"])
+    batches = []
+    rows = 0
+    for batch in reader:
+        batches.append(batch)
+        rows += batch.num_rows
+        if rows >= chunk_rows:
+            yield counters_frame(pa.Table.from_batches(batches, reader.schema), names)
+            batches = []
+            rows = 0
+    if batches:
+        yield counters_frame(pa.Table.from_batches(batches, reader.schema), names)
+
+
+def counters_frame(table, names):
+    """
+    Returns a data frame of a table or record batch CounterWriter wrote, with the counter
+    ids replaced by the counter names
+    """
+    df = table.to_pandas()
+    df["counter"] = pd.Categorical.from_codes(df["counter"], names)
+    return df
+
+
 #Counter = namedtuple("Counter", "ctr1 ctr2")
 class PMUEventCounter:
     def __init__(self, name, program_str, per_cpu=True, agg_func=None):
@@ -81,6 +210,12 @@ class PMUEventCounter:
     def is_per_cpu(self):
         return self.per_cpu
 
+    def get_num_events(self):
+        """
+        Returns how many hardware counters programming this counter takes
+        """
+        return 1
+
 
 class PMUCompositeEventCounter(PMUEventCounter):
     def get_event_to_program(self, group):
@@ -94,7 +229,10 @@ class PMUCompositeEventCounter(PMUEventCounter):
             program_strings.append(ps)
 
         return f"{','.join(program_strings)}"
-    
+
+    def get_num_events(self):
+        return len(self.program_str)
+
 
 class ArmCMN700EventCounter(PMUEventCounter):
     """
@@ -164,65 +302,27 @@ class CounterConfig:
     def get_denominator(self):
         return self.denominator
 
-    def _compute_stat(self, ctr1_df, ctr2_df, idx):
-        # Divide ctr1 by ctr2 matched up by indices over a preset value.
-        try:
-            s = (ctr1_df.loc[idx]["count"] / ctr2_df.loc[idx]["count"]) * self.scale  # noqa
-            s = s.dropna()
-            return s
-        except Exception:
-            return None
-
     def create_stat(self, df):
         """
         Returns series of the counter ratios from the individual counter measurements for
-        plotting or statistical manipulation
+        plotting or statistical manipulation.  df is the table built by pivot_counters,
+        ratios only come from rows where the same group measured both counters.
         """
-        # Group the same counters together that may form a composite event, or come from different PMUs, and aggregate their counts
-        dfs = []
-        dfn = (
-            df[df["counter"] == self.numerator.get_canonical_name()][["count", "event", "group", "counter"]]
-            .reset_index()
-            .groupby(by=["normalized_time", "CPU", "event", "group", "counter"], as_index=False)
-            .aggregate(self.numerator.agg_func)
-            .set_index(["normalized_time", "CPU"])
-        )
-        dfs.append(dfn)
-        if self.denominator:
-            dfd = (
-                df[df["counter"] == self.denominator.get_canonical_name()][["count", "event", "group", "counter"]]
-                .reset_index()
-                .groupby(by=["normalized_time", "CPU", "event", "group", "counter"], as_index=False)
-                .aggregate(self.denominator.agg_func)
-                .set_index(["normalized_time", "CPU"])
-            )
-            dfs.append(dfd)
-        df = pd.concat(dfs, sort=False).sort_index()
-
-
-        if self.numerator and not self.denominator:
-            return (df[df["counter"] == self.numerator.get_canonical_name()]["count"].reset_index(drop=True)) * self.scale
-
-        # Find the groups our counters belong to, the intersection of the groups are the measurements we
-        # can use to calculate the ratio accurately.
-        series = []
-        group_id = (
-            set(df[df["counter"] == self.numerator.get_canonical_name()]["group"].unique())
-            & set(df[df["counter"] == self.denominator.get_canonical_name()]["group"].unique())
-        )
-
-        for group in group_id:
-            ctr1_df = df[(df["counter"] == self.numerator.get_canonical_name()) & (df["group"] == group)]
-            ctr2_df = df[(df["counter"] == self.denominator.get_canonical_name()) & (df["group"] == group)]
-
-            idx = df[(df["group"] == group)].index
-
-            s = self._compute_stat(ctr1_df, ctr2_df, idx)
-            if s is not None and s.size:
-                series.append(s)
-
-        if len(series):
-            return pd.concat(series)
+        numerator = self.numerator.get_canonical_name()
+        if numerator not in df.columns:
+            return None
+
+        if not self.denominator:
+            return df[numerator].dropna() * self.scale
+
+        denominator = self.denominator.get_canonical_name()
+        if denominator not in df.columns:
+            return None
+
+        s = (df[numerator] / df[denominator]) * self.scale
+        s = s.dropna()
+        if s.size:
+            return s
         else:
             return None
 
@@ -276,31 +376,103 @@ def mask_signals():
 
 
 # Measurement and processing functions
-def perfstat(counter_groups, timeout=None, cpus=None):
+def get_cpu_list():
+    """
+    Returns the CPUs lscpu lists, as strings
+    """
+    res = subprocess.run(["lscpu", "-p=CPU"], check=True, stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+    cpus = []
+    for line in res.stdout.decode("utf-8").splitlines():
+        match = re.search(r"""^(\d+)$""", line)
+        if match is not None:
+            cpus.append(match.group(1))
+    return cpus
+
+
+def nmi_watchdog_enabled(path=NMI_WATCHDOG):
+    """
+    Whether the kernel's hard lockup detector is running, it keeps a cycles event
+    programmed on every CPU
+    """
+    try:
+        with open(path) as f:
+            return f.read().strip() != "0"
+    except OSError:
+        return False
+
+
+def get_cpu_topology(root=CPU_SYSFS):
+    """
+    Returns a data frame indexed by CPU with the NUMA node and socket of every CPU
+    """
+    rows = []
+    for path in glob.glob(os.path.join(root, "cpu[0-9]*")):
+        cpu = int(os.path.basename(path)[3:])
+        # Offline CPUs have no topology directory
+        try:
+            with open(os.path.join(path, "topology", "physical_package_id")) as f:
+                socket = int(f.read())
+        except OSError:
+            socket = 0
+        nodes = glob.glob(os.path.join(path, "node[0-9]*"))
+        node = int(os.path.basename(nodes[0])[4:]) if nodes else 0
+        rows.append((cpu, node, socket))
+    return pd.DataFrame(rows, columns=["CPU", "node", "socket"]).set_index("CPU").sort_index()
+
+
+def name_groups(counter_groups):
+    """
+    Gives every counter group a name unique over all PMUs.  Returns a dict with the
+    list of (group name, counter set) of each PMU.
+    """
+    named = {}
+    i = 0
+    for pmu in counter_groups.keys():
+        named[pmu] = []
+        for ctrset in counter_groups[pmu]:
+            named[pmu].append((f"group{i}", ctrset))
+            i += 1
+    return named
+
+
+def run_per_pmu(rotate, groups):
+    """
+    Runs rotate(pmu groups) for the groups of every PMU at the same time, each in a
+    thread of its own.  The PMUs are independent, so while the core PMU goes through
+    its groups the mesh PMUs count too, over the same windows of time.
+    """
+    threads = [threading.Thread(target=rotate, args=(pmu_groups,)) for pmu_groups in groups.values()]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+
+def perfstat(counter_groups, timeout=None, cpus=None, monitor=None):
     """
     Measure performance counters using perf-stat in a subprocess.
     Stores results into a CSV file.  Uses our own multiplexing loop
     which is cheaper than letting perf in the kernel do multiplexing.
+    Each PMU runs its own loop, their output is merged into the CSV with
+    times counted from the start of the measurement.  With a monitor, stops
+    once it has converged.
     """
     try:
         if not cpus:
-            res = subprocess.run(["lscpu", "-p=CPU"], check=True, stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
-            cpus = []
-            for line in res.stdout.decode("utf-8").splitlines():
-                match = re.search(r"""^(\d+)$""", line)
-                if match is not None:
-                    cpus.append(match.group(1))
+            cpus = get_cpu_list()
 
         sig = SignalWatcher()
         if timeout:
             signal.alarm(timeout)
-        out = open(RESULTS_CSV, "a")
-
-        while not sig.kill_now:  # waits until a full measurement cycle is done.
-            i = 0
-            for pmu in counter_groups.keys():
-                for ctrset in counter_groups[pmu]:
-                    group = f"group{i}"
+        out = CounterWriter(RESULTS_ARROW, counter_groups, monitor)
+        start = time.monotonic()
+
+        def rotate(groups):
+            # Signals are handled by the main thread, perf inherits the mask and ignores them
+            mask_signals()
+            # waits until a full measurement cycle is done.
+            while not sig.kill_now and not (monitor and monitor.converged):
+                for group, ctrset in groups:
                     # Forms the perf counter format with a unique group and hash to form the name
                     #XXX: For arm_cmn, getting a None type for a counter to program, so that's odd....
                     counters = [ctr.get_event_to_program(group)for ctr in ctrset]
@@ -333,14 +505,34 @@ def perfstat(counter_groups, timeout=None, cpus=None):
                     ])
 
                     # TODO: How to work with CMN and tell perf how to program the PMU
-                    proc = subprocess.Popen(
+                    offset = time.monotonic() - start
+                    proc = subprocess.run(
                         perf_cmd,
-                        preexec_fn=mask_signals,
-                        stdout=subprocess.PIPE,
-                        stderr=out,
+                        stdout=subprocess.DEVNULL,
+                        stderr=subprocess.PIPE,
                     )
-                    proc.wait()
-                    i += 1
+
+                    # Convert perf's -x| rows, perf counts time from its own start, count it
+                    # from ours instead.  Anything else perf prints is passed on.
+                    times, cpus_measured, events, counts, fracs = [], [], [], [], []
+                    for line in proc.stderr.decode("utf-8").splitlines(keepends=True):
+                        fields = line.split("|")
+                        if len(fields) < 7 or fields[4] not in out.event_ids:
+                            sys.stderr.write(line)
+                            continue
+                        times.append(float(fields[0]) + offset)
+                        cpus_measured.append(int(fields[1][len("CPU"):]))
+                        events.append(fields[4])
+                        # <not counted> and <not supported> counts are missing.  perf
+                        # extrapolates counts to the whole interval, store what was counted.
+                        fracs.append(float(fields[6] or "nan"))
+                        try:
+                            counts.append(float(fields[2]) * fracs[-1] / 100.0)
+                        except ValueError:
+                            counts.append(np.nan)
+                    out.write(times, cpus_measured, events, counts, fracs)
+
+        run_per_pmu(rotate, name_groups(counter_groups))
         out.close()
         if timeout:
             # Cancel the timeout if any before leaving the loop
@@ -349,117 +541,440 @@ def perfstat(counter_groups, timeout=None, cpus=None):
         print("Failed to measure performance counters.")
 
 
-def calculate_counter_stat(platforms):
+def open_event_groups(counter_groups, cpus):
+    """
+    Opens every counter group on every CPU it measures, disabled.  Returns a dict with
+    the list of (group name, EventGroups) of each PMU.
+    """
+    groups = {}
+    for pmu, named in name_groups(counter_groups).items():
+        groups[pmu] = []
+        for group, ctrset in named:
+            events = parse_events(",".join(ctr.get_event_to_program(group) for ctr in ctrset))
+
+            # The kernel only groups events of one PMU, e.g. each mesh of a CMN700 counter
+            # goes in a group of its own, and perf-stat opens them on the same CPUs
+            per_cpu = next(iter(ctrset)).is_per_cpu()
+            by_pmu = defaultdict(list)
+            for event in events:
+                by_pmu[event[0]].append(event)
+
+            opened = []
+            groups[pmu].append((group, opened))
+            for event_pmu, pmu_events in by_pmu.items():
+                if per_cpu:
+                    pmu_cpus = cpus
+                else:
+                    pmu_cpus = [event_pmu.cpus[0] if event_pmu.cpus else 0]
+                for cpu in pmu_cpus:
+                    try:
+                        opened.append(EventGroup(pmu_events, cpu))
+                    except OSError:
+                        close_event_groups(groups)
+                        raise
+    return groups
+
+
+def close_event_groups(groups):
+    for pmu_groups in groups.values():
+        for group, opened in pmu_groups:
+            for event_group in opened:
+                event_group.close()
+
+
+def perf_event_stat(counter_groups, timeout=None, cpus=None, monitor=None):
+    """
+    Measure performance counters with perf_event_open instead of perf-stat.  Every
+    group is opened once on every CPU up front, then the groups of each PMU take turns
+    counting for SAMPLE_INTERVAL, enabled and disabled by us and read with one read()
+    per group and CPU.  This saves starting perf and programming the events for every
+    interval and the gaps between groups that come with it.  Writes the same file as
+    perfstat and stops early the same way.
+    """
+    cpus = [int(cpu) for cpu in (cpus or get_cpu_list())]
+
+    # Every event on every CPU takes a file descriptor, allow as many as we may
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    if soft != hard:
+        resource.setrlimit(resource.RLIMIT_NOFILE, (hard, hard))
+
+    groups = {}
+    try:
+        groups = open_event_groups(counter_groups, cpus)
+
+        sig = SignalWatcher()
+        if timeout:
+            signal.alarm(timeout)
+        out = CounterWriter(RESULTS_ARROW, counter_groups, monitor)
+        start = time.monotonic()
+
+        def rotate(pmu_groups):
+            # waits until a full measurement cycle is done.
+            while not sig.kill_now and not (monitor and monitor.converged):
+                for group, opened in pmu_groups:
+                    for event_group in opened:
+                        event_group.enable()
+                    time.sleep(SAMPLE_INTERVAL)
+                    for event_group in opened:
+                        event_group.disable()
+                    elapsed = time.monotonic() - start
+
+                    # Counts as counted, calculate_counter_stat scales them by frac
+                    cpus_measured, events, counts, fracs = [], [], [], []
+                    for event_group in opened:
+                        enabled, running, values = event_group.read()
+                        for name, value in zip(event_group.names, values):
+                            cpus_measured.append(event_group.cpu)
+                            events.append(name)
+                            if running:
+                                counts.append(value)
+                                fracs.append(100.0 * running / enabled)
+                            else:
+                                counts.append(np.nan)
+                                fracs.append(0.0)
+                    out.write([elapsed] * len(events), cpus_measured, events, counts, fracs)
+
+        run_per_pmu(rotate, groups)
+        out.close()
+        if timeout:
+            # Cancel the timeout if any before leaving the loop
+            signal.alarm(0)
+    except OSError as e:
+        print(f"Failed to measure performance counters: {e}")
+    finally:
+        close_event_groups(groups)
+
+
+def pivot_counters(df, platforms):
     """
-    Process out csv file from perf out to a set of aggregate statistics
-    """
-    df = pd.read_csv(
-        RESULTS_CSV,
-        sep="|",
-        header=None,
-        names=["time", "CPU", "count", "rsrvd1", "event", "rsrvd2", "frac", "rsrvd3", "rsrvd4"],
-        dtype={
-            "time": np.float64,
-            "CPU": str,
-            "count": np.float64,
-            "rsrvd1": str,
-            "event": str,
-            "rsrvd2": str,
-            "frac": np.float64,
-            "rsrvd3": str,
-            "rsrvd4": str,
-        },
-        na_values=["<not counted>", "<not supported>"],
-    )
-
-    # Filter counter event names into a group id and back
-    # into the human readable counter definition.
-    def split_counter_group(row):
-        group, counter = row.event.split("-")
-        row["group"] = group
-        row["counter"] = counter
-        return row
+    Aggregates the counts of each counter measured by a group on a CPU at a normalized
+    time with the counter's agg_func, e.g. to combine the events of a composite counter,
+    into one table indexed by (normalized_time, CPU, group) with a column per counter.
+    """
+    agg_funcs = {}
+    for platform in platforms:
+        for counter in platform.get_counters():
+            for ctr in (counter.get_numerator(), counter.get_denominator()):
+                if ctr is not None:
+                    agg_funcs[ctr.get_canonical_name()] = ctr.agg_func
+
+    keys = ["normalized_time", "CPU", "group", "counter"]
+    custom = [name for name, agg_func in agg_funcs.items() if agg_func != "sum"]
+    is_custom = df["counter"].isin(custom)
+    # counter is categorical, only keep the counters each group measured
+    counts = [df[~is_custom].groupby(keys, observed=True)["count"].sum()]
+    for name in custom:
+        rows = df[df["counter"] == name]
+        if len(rows):
+            counts.append(rows.groupby(keys, observed=True)["count"].aggregate(agg_funcs[name]))
+
+    df = pd.concat(counts).unstack("counter")
+    df.columns = df.columns.astype(str)
+    return df
+
+
+def percentile_ranks(n, percentile, confidence=CONFIDENCE):
+    """
+    Returns the 1 based ranks of the order statistics of n values whose interval holds
+    a percentile with the given confidence, under the binomial distribution of the
+    number of values below it.  Ranks outside 1 to n mean there are too few values.
+    """
+    q = percentile / 100.0
+    alpha = 1.0 - confidence
+    lower = int(stats.binom.ppf(alpha / 2, n, q))
+    upper = int(stats.binom.ppf(1 - alpha / 2, n, q)) + 1
+    return lower, upper
+
+
+def percentile_ci(sketch, percentile, confidence=CONFIDENCE):
+    """
+    Distribution free confidence interval of a percentile, the order statistics of
+    percentile_ranks looked up in the sketch
+    """
+    n = len(sketch)
+    lower, upper = percentile_ranks(n, percentile, confidence)
+    return [sketch.at_rank(max(lower, 1) - 1), sketch.at_rank(min(upper, n) - 1)]
+
+
+def geomean_ci(sketch, confidence=CONFIDENCE):
+    """
+    Confidence interval of the geometric mean assuming the values are log-normal, the
+    t interval of the mean of their logs
+    """
+    n = len(sketch)
+    geomean = sketch.geomean()
+    if n < 2 or geomean == 0:
+        # The geomean of values with a zero is zero
+        return [geomean, geomean]
+    half_width = stats.t.ppf(0.5 + confidence / 2, n - 1) * sketch.log_std() / math.sqrt(n)
+    return [geomean * math.exp(-half_width), geomean * math.exp(half_width)]
+
+
+def extrapolate_counts(df):
+    """
+    Prepares the rows of read_counters for pivot_counters
+    """
+    # Events that had to share the PMU only counted for frac percent of the interval,
+    # extrapolate their counts to the whole interval.  Events that never ran are missing.
+    frac = df["frac"].to_numpy()
+    df["count"] = np.where(frac > 0, df["count"].to_numpy() * 100.0 / np.where(frac > 0, frac, 1), np.nan)
 
     # Normalize our time value to serve as an index along with CPU
-    # for easier processing.
-    time_offset = 0
-    cur_time = 0
-    cur_group_id = ""
-
-    def normalize_time(row):
-        # Each time the group changes, update our time offset as we have started
-        # a new set of measurements, but time resets.
-        nonlocal time_offset
-        nonlocal cur_time
-        nonlocal cur_group_id
-        # Initial group_id assignment
-        if not cur_group_id:
-            cur_group_id = row["group"]
-        if cur_group_id != row["group"]:
-            time_offset = int(math.ceil(time_offset + row["time"]))
-            cur_group_id = row["group"]
-        cur_time = int(math.ceil(row["time"] + time_offset))  # round up to whole seconds
-        row["normalized_time"] = cur_time
-        return row
-
-    df = df.apply(split_counter_group, axis=1)
-    df = df.apply(normalize_time, axis=1)
-    df = df.set_index(["normalized_time", "CPU"])
-    data = {}
+    # for easier processing.  Times count from the start of the measurement
+    # for every PMU, so the windows of groups of different PMUs measured at
+    # the same time line up.
+    df["normalized_time"] = np.ceil(df["time"]).astype(np.int64)  # round up to whole seconds
+    return df
 
+
+class StatSketches:
+    """
+    Keeps a quantile sketch of every stat of the platforms, fed with the rows of
+    read_counters one or more group intervals at a time.  With per_cpu it also keeps a
+    sketch of every stat of a per CPU counter on each CPU, under cpu_sketches.
+    """
+
+    def __init__(self, platforms, relative_accuracy=DEFAULT_RELATIVE_ACCURACY, per_cpu=False):
+        self.platforms = platforms
+        self.relative_accuracy = relative_accuracy
+        self.sketches = {counter.get_name(): DDSketch(relative_accuracy)
+                         for platform in platforms
+                         for counter in platform.get_counters()}
+        self.per_cpu = per_cpu
+        self.cpu_sketches = defaultdict(dict)
+
+    def update(self, df):
+        df = pivot_counters(extrapolate_counts(df), self.platforms)
+        for platform in self.platforms:
+            for counter in platform.get_counters():
+                series_res = counter.create_stat(df)
+                if series_res is not None:
+                    self.add(counter, series_res)
+
+    def add(self, counter, series_res):
+        # Values that are not finite, like ratios to a zero count, are left out
+        self.sketches[counter.get_name()].add(series_res.to_numpy())
+        if self.per_cpu and counter.get_numerator().is_per_cpu():
+            self.update_cpus(counter.get_name(), series_res)
+
+    def update_cpus(self, stat_name, series_res):
+        cpu_sketches = self.cpu_sketches[stat_name]
+        for cpu, values in series_res.groupby(level="CPU"):
+            if cpu not in cpu_sketches:
+                cpu_sketches[cpu] = DDSketch(self.relative_accuracy)
+            cpu_sketches[cpu].add(values.to_numpy())
+
+
+class ConvergenceMonitor(StatSketches):
+    """
+    Keeps the stat sketches up to date as CounterWriter writes the measurements.
+    The values a group measures on every CPU in one window rise and fall together, so
+    they are not independent samples of a stat.  Convergence is judged on one value per
+    window instead, the given percentiles of the stat over the CPUs of the window, which
+    is the stat itself for counters that are not per CPU, like the CMN's.  Converged
+    once every stat was measured in at least min_windows windows and the CONFIDENCE
+    intervals of the mean of its per window percentiles are within relative_error.
+    """
+
+    def __init__(self, platforms, relative_error, percentiles=(50, 99), min_windows=MIN_CONVERGE_WINDOWS):
+        super().__init__(platforms)
+        self.relative_error = relative_error
+        self.percentiles = percentiles
+        self.min_windows = min_windows
+        # Per window percentiles of every stat, a row of them per window
+        self.windows = {name: [] for name in self.sketches}
+        self.converged = False
+        self.start = time.monotonic()
+        self.elapsed = None
+
+    def update(self, df):
+        super().update(df)
+        if all(self.stat_converged(name) for name in self.windows):
+            self.converged = True
+            self.elapsed = time.monotonic() - self.start
+
+    def add(self, counter, series_res):
+        super().add(counter, series_res)
+        values = series_res[np.isfinite(series_res)]
+        if values.size:
+            windows = values.groupby(level=["normalized_time", "group"]).quantile(
+                [percentile / 100.0 for percentile in self.percentiles]).unstack()
+            self.windows[counter.get_name()].extend(windows.to_numpy())
+
+    def stat_error(self, name):
+        """
+        Half the width of the CONFIDENCE interval of the mean of each per window
+        percentile of a stat relative to the mean, the t interval over the windows
+        """
+        windows = np.array(self.windows[name]).reshape(-1, len(self.percentiles))
+        n = len(windows)
+        if n < max(self.min_windows, 2):
+            return np.full(len(self.percentiles), math.inf)
+        mean = windows.mean(axis=0)
+        half_width = stats.t.ppf(0.5 + CONFIDENCE / 2, n - 1) * windows.std(axis=0, ddof=1) / math.sqrt(n)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            return np.where(mean != 0, half_width / np.abs(mean), np.where(half_width == 0, 0.0, math.inf))
+
+    def stat_converged(self, name):
+        return bool(np.all(self.stat_error(name) <= self.relative_error))
+
+
+def calculate_counter_stat(platforms):
+    """
+    Process the counters perfstat measured to a set of aggregate statistics, each with
+    its CONFIDENCE interval under <stat>_ci.  The measurements are read a chunk at a
+    time into a quantile sketch per stat, so memory does not grow with the runtime.
+    """
+    sketches = StatSketches(platforms, per_cpu=True)
+    for df in iter_counters(RESULTS_ARROW):
+        sketches.update(df)
+
+    data = {}
     for platform in platforms:
         counter_list = platform.get_counters()
         for counter in counter_list:
             stat_name = counter.get_name()
-            series_res = counter.create_stat(df)
-
-            try:
-                series_res.replace([np.inf, -np.inf], np.nan, inplace=True)
-                series_res.dropna(inplace=True)
-
-                # Calculate some meaningful aggregate stats for comparisons
-                geomean = stats.gmean(series_res)
-                p10 = stats.scoreatpercentile(series_res, 10)
-                p50 = stats.scoreatpercentile(series_res, 50)
-                p90 = stats.scoreatpercentile(series_res, 90)
-                p95 = stats.scoreatpercentile(series_res, 95)
-                p99 = stats.scoreatpercentile(series_res, 99)
-                p999 = stats.scoreatpercentile(series_res, 99.9)
-                p100 = stats.scoreatpercentile(series_res, 100)
-
-                data[stat_name] = {
-                    "geomean": geomean,
-                    "p10": p10,
-                    "p50": p50,
-                    "p90": p90,
-                    "p95": p95,
-                    "p99": p99,
-                    "p99.9": p999,
-                    "p100": p100,
-                }
-            except:  # noqa
+            sketch = sketches.sketches[stat_name]
+
+            # Calculate some meaningful aggregate stats for comparisons
+            if len(sketch):
+                data[stat_name] = summarize(sketch, STAT_PERCENTILES)
+                data[stat_name]["geomean_ci"] = geomean_ci(sketch)
+                for name, percentile in STAT_PERCENTILES.items():
+                    data[stat_name][f"{name}_ci"] = percentile_ci(sketch, percentile)
+            else:
                 data[stat_name] = {
                     "geomean": 0,
-                    "p10": 0,
-                    "p50": 0,
-                    "p90": 0,
-                    "p95": 0,
-                    "p99": 0,
-                    "p99.9": 0,
-                    "p100": 0,
+                    "geomean_ci": [0, 0],
                 }
+                for name in STAT_PERCENTILES:
+                    data[stat_name][name] = 0
+                    data[stat_name][f"{name}_ci"] = [0, 0]
     with open(RESULTS_JSON, "w") as f:
         json.dump(data, f)
+
+    write_breakdown(calculate_breakdown(sketches, get_cpu_topology()), RESULTS_BREAKDOWN_JSON)
+    return data
+
+
+def modified_z_scores(values, resolution=0.0, min_mad=0.0):
+    """
+    Modified z-scores (Iglewicz and Hoaglin) of the rows of a 2D array, column by column:
+    0.6745 * (x - median) / MAD.  Where the MAD is 0, the mean absolute deviation scaled
+    by 1.2533 takes its place.  The MAD is taken to be at least min_mad, per column or
+    for all.  Columns whose MAD is at or below resolution times their median, the spread
+    the values are known to, missing values and columns of equal values score 0.
+    """
+    median = np.nanmedian(values, axis=0)
+    deviation = values - median
+    mad = np.nanmedian(np.abs(deviation), axis=0)
+    mean_ad = np.nanmean(np.abs(deviation), axis=0)
+    scale = np.maximum(mad, min_mad)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        z = np.where(scale > 0, 0.6745 * deviation / scale, deviation / (1.253314 * mean_ad))
+    if resolution:
+        z[:, mad <= resolution * np.abs(median)] = 0.0
+    return np.nan_to_num(z, nan=0.0, posinf=0.0, neginf=0.0)
+
+
+def calculate_breakdown(sketches, topology):
+    """
+    Returns a table per CPU, NUMA node and socket of the geomean and percentiles of every
+    per CPU stat, indexed by (stat, cpu/node/socket).  The sketches of the CPUs of a node
+    or socket are merged into one.  A unit with OUTLIER_MIN_SAMPLES samples of a stat is
+    flagged as an outlier when its p50 has a modified z-score past OUTLIER_Z_SCORE among
+    the units of its level and the CONFIDENCE interval of the p50 leaves out their median.
+    """
+    tables = {}
+    for level in ("cpu", "node", "socket"):
+        rows = []
+        for stat_name, cpu_sketches in sketches.cpu_sketches.items():
+            merged = {}
+            for cpu, sketch in cpu_sketches.items():
+                if level == "cpu":
+                    unit = cpu
+                elif cpu in topology.index:
+                    unit = int(topology.at[cpu, level])
+                else:
+                    unit = 0
+                if unit not in merged:
+                    merged[unit] = DDSketch(sketch.relative_accuracy)
+                merged[unit].merge(sketch)
+            for unit, sketch in merged.items():
+                row = {"stat": stat_name, level: unit, "samples": len(sketch)}
+                row.update(summarize(sketch, STAT_PERCENTILES))
+                row["p50_ci_low"], row["p50_ci_high"] = percentile_ci(sketch, 50)
+                rows.append(row)
+        if not rows:
+            continue
+
+        df = pd.DataFrame(rows).set_index(["stat", level]).sort_index()
+        # One row per unit and a column per stat, so every stat is scored at once.  Units
+        # with too few samples are left out of the median and MAD of the others.
+        scored = df["samples"] >= OUTLIER_MIN_SAMPLES
+        p50 = df["p50"].where(scored).unstack("stat")
+        # p50s closer than the width of a sketch bucket can't be told apart, and the p50s
+        # of units measuring the same thing still spread by their standard error, about
+        # the MAD of the p50s of the units when they differ by noise only
+        standard_error = ((df["p50_ci_high"] - df["p50_ci_low"]) / (2 * stats.norm.ppf(0.5 + CONFIDENCE / 2)))
+        noise_mad = 0.6745 * standard_error.where(scored).unstack("stat").median().to_numpy()
+        with warnings.catch_warnings():
+            # Stats no unit has enough samples of are all NaN
+            warnings.simplefilter("ignore", RuntimeWarning)
+            z = modified_z_scores(p50.to_numpy(), 2 * sketches.relative_accuracy, noise_mad)
+            median = pd.DataFrame(np.broadcast_to(np.nanmedian(p50.to_numpy(), axis=0), p50.shape),
+                                  index=p50.index, columns=p50.columns)
+        if len(p50) < 3:
+            # Too few units to tell an outlier apart
+            z[:] = 0.0
+        z = pd.DataFrame(z, index=p50.index, columns=p50.columns)
+        df["p50_z"] = z.stack().reorder_levels(["stat", level]).reindex(df.index)
+        median = median.stack().reorder_levels(["stat", level]).reindex(df.index)
+        df["outlier"] = ((df["p50_z"].abs() > OUTLIER_Z_SCORE) & (df["samples"] >= OUTLIER_MIN_SAMPLES) &
+                         ((df["p50_ci_low"] > median) | (df["p50_ci_high"] < median)))
+        tables[level] = df
+    return tables
+
+
+def write_breakdown(tables, path=RESULTS_BREAKDOWN_JSON):
+    """
+    Writes the tables of calculate_breakdown as {level: {stat: {unit: {stat: value}}}}
+    """
+    data = {}
+    for level, df in tables.items():
+        data[level] = defaultdict(dict)
+        for (stat_name, unit), row in df.iterrows():
+            values = {name: float(value) for name, value in row.items()
+                      if name not in ("samples", "outlier", "p50_ci_low", "p50_ci_high")}
+            values["p50_ci"] = [float(row["p50_ci_low"]), float(row["p50_ci_high"])]
+            values["samples"] = int(row["samples"])
+            values["outlier"] = bool(row["outlier"])
+            data[level][stat_name][str(unit)] = values
+    with open(path, "w") as f:
+        json.dump(data, f)
     return data
 
 
+def print_outliers(breakdown):
+    """
+    Prints the CPUs, nodes and sockets write_breakdown flagged as outliers
+    """
+    for level, stat_table in breakdown.items():
+        for stat_name, units in stat_table.items():
+            for unit, values in units.items():
+                if values["outlier"]:
+                    print(f"Outlier {level} {unit}: {stat_name} p50 {values['p50']:.2f} "
+                          f"(modified z-score {values['p50_z']:.1f})")
+
+
 def pretty_print_table(counter_table):
     """
     Takes a table of calculated counter ratios and percentiles and
-    prints them in a formatted table for viewing.
+    prints them in a formatted table for viewing.  Confidence intervals
+    are left out.
     """
     ratios = [key for key in counter_table.keys()]
-    stats = [key for key in counter_table[ratios[0]].keys()]
+    stats = [key for key, value in counter_table[ratios[0]].items() if not isinstance(value, list)]
 
     hdr_string = f"|{'Ratio':<20}|"
     for stat in stats:
@@ -473,65 +988,232 @@ def pretty_print_table(counter_table):
         print(line)
 
 
+def load_results(paths):
+    """
+    Loads RESULTS_JSON files of several runs into {stat: [its values in every run]}
+    """
+    results = defaultdict(list)
+    for path in paths:
+        with open(path) as f:
+            for stat_name, values in json.load(f).items():
+                results[stat_name].append(values)
+    return results
+
+
+def stat_platforms():
+    """
+    Returns the counter_mapping platforms that define each stat, by stat name
+    """
+    platforms = defaultdict(list)
+    for platform, counter_list in counter_mapping.items():
+        for counter in counter_list:
+            platforms[counter.get_name()].append(platform)
+    return platforms
+
+
+def compare_stat(stat_name, baseline, candidate, metric, alpha=COMPARE_ALPHA):
+    """
+    Compares a metric of a stat over the baseline and candidate runs.  With two or more
+    runs a side the difference of the means is judged by Welch's t-test, with one run a
+    side by whether the metric's confidence intervals overlap.
+    """
+    base = np.array([values[metric] for values in baseline], dtype=np.float64)
+    cand = np.array([values[metric] for values in candidate], dtype=np.float64)
+    base_mean = base.mean()
+    cand_mean = cand.mean()
+    delta = cand_mean / base_mean - 1 if base_mean else math.nan
+
+    p_value = math.nan
+    if len(base) > 1 and len(cand) > 1:
+        p_value = stats.ttest_ind(cand, base, equal_var=False).pvalue
+        significant = p_value < alpha
+    elif f"{metric}_ci" in baseline[0] and f"{metric}_ci" in candidate[0]:
+        base_low, base_high = baseline[0][f"{metric}_ci"]
+        cand_low, cand_high = candidate[0][f"{metric}_ci"]
+        significant = cand_low > base_high or cand_high < base_low
+    else:
+        significant = False
+
+    verdict = ""
+    if significant and cand_mean != base_mean:
+        if stat_name in HIGHER_IS_BETTER:
+            better = cand_mean > base_mean
+        elif LOWER_IS_BETTER.search(stat_name):
+            better = cand_mean < base_mean
+        else:
+            better = None
+        if better is not None:
+            verdict = "improvement" if better else "regression"
+
+    return {
+        "baseline": base_mean,
+        "candidate": cand_mean,
+        "delta": delta,
+        "p_value": p_value,
+        "significant": significant,
+        "verdict": verdict,
+    }
+
+
+def compare_results(baseline_paths, candidate_paths, metric="geomean", alpha=COMPARE_ALPHA):
+    """
+    Compares the stats of the baseline and candidate runs by name, e.g. of an x86 and a
+    Graviton host.  Returns the comparison of the stats measured on both sides and the
+    names of those only measured on one, like flop-sve-pkc.
+    """
+    baseline = load_results(baseline_paths)
+    candidate = load_results(candidate_paths)
+
+    comparison = {}
+    for stat_name in baseline:
+        if stat_name in candidate:
+            comparison[stat_name] = compare_stat(stat_name, baseline[stat_name], candidate[stat_name],
+                                                 metric, alpha)
+    baseline_only = [stat_name for stat_name in baseline if stat_name not in candidate]
+    candidate_only = [stat_name for stat_name in candidate if stat_name not in baseline]
+    return comparison, baseline_only, candidate_only
+
+
+def print_comparison(comparison, baseline_only, candidate_only):
+    """
+    Prints the comparison of compare_results, regressions highlighted
+    """
+    highlight = sys.stdout.isatty()
+    print(f"|{'Ratio':<20}|{'baseline':>10}|{'candidate':>10}|{'delta':>10}|{'p-value':>10}|")
+    for stat_name, result in comparison.items():
+        # Single runs have no p-value, their confidence intervals are compared instead
+        p_value = "-" if math.isnan(result["p_value"]) else f"{result['p_value']:.3f}"
+        line = (f"|{stat_name:<20}|{result['baseline']:>10.2f}|{result['candidate']:>10.2f}|"
+                f"{result['delta']:>+10.1%}|{p_value:>10}|")
+        if result["verdict"] == "regression":
+            line += " REGRESSION"
+            if highlight:
+                line = f"\033[1;31m{line}\033[0m"
+        elif result["verdict"]:
+            line += f" {result['verdict']}"
+        elif result["significant"]:
+            line += " changed"
+        print(line)
+
+    platforms = stat_platforms()
+    for side, names in (("baseline", baseline_only), ("candidate", candidate_only)):
+        for stat_name in names:
+            defined_by = ", ".join(platforms.get(stat_name, [])) or "unknown platform"
+            print(f"{stat_name}: only measured on the {side} ({defined_by})")
+
+
 def build_groups(platforms):
     """
     Takes a list of counter ratios and divides them into a minimal set of groups that we
     can multiplex onto the CPU PMU.  Numerators and denominators are scheduled together
     to avoid artifacts with the ratios.
+
+    Platforms sharing a PMU are scheduled together and every counter is programmed at
+    most once per group, however many ratios use it.  Counters the PMU counts on a fixed
+    counter, like the cycle counter, do not take one of the group's general purpose
+    counters, though only one event of a group can use each fixed counter.  Ratios are
+    placed largest denominator first, each into the group it adds the fewest counters
+    to, and a new group is only started when none has room.
     """
-    # Counter groupings by denominator
-    pmu_sets = {}
+    # Ratios, group size and fixed counters of each PMU
+    pmu_ratios = defaultdict(list)
+    pmu_max_ctrs = {}
+    pmu_fixed_ctrs = defaultdict(list)
     for platform in platforms:
-        groups = defaultdict(list)
-        MAX_COUNTERS_IN_GROUP = platform.get_max_ctrs()
-
-        counters = platform.get_counters()
-        pmu = None
-        for ctr in counters:
-            denom = ctr.get_denominator()
-            numer = ctr.get_numerator()
+        for ctr in platform.get_counters():
             pmu = ctr.get_pmu()
+            pmu_ratios[pmu].append((ctr.get_numerator(), ctr.get_denominator()))
+            pmu_max_ctrs[pmu] = min(pmu_max_ctrs.get(pmu, platform.get_max_ctrs()), platform.get_max_ctrs())
+            pmu_fixed_ctrs[pmu].extend(platform.get_fixed_ctrs())
+
+    pmu_sets = {}
+    for pmu, ratios in pmu_ratios.items():
+        MAX_COUNTERS_IN_GROUP = pmu_max_ctrs[pmu]
+        fixed_ctrs = pmu_fixed_ctrs[pmu]
+
+        def general_ctrs(ctrs):
+            # Events with the same encoding, like Intel's insts and instructions, share
+            # one fixed counter, a second one in the group takes a general purpose counter
+            count = 0
+            fixed_used = set()
+            for ctr in ctrs:
+                if ctr.program_str in fixed_ctrs and ctr.program_str not in fixed_used:
+                    fixed_used.add(ctr.program_str)
+                else:
+                    count += ctr.get_num_events()
+            return count
 
-            groups[denom].append(numer)
+        # Counter groupings by denominator, the denominators with most numerators first.
+        # Counters without a denominator go last, they may already be in some group.
+        groups = defaultdict(list)
+        for numer, denom in ratios:
+            if numer not in groups[denom]:
+                groups[denom].append(numer)
+        denoms = sorted(groups.keys(), key=lambda denom: (denom is None, -general_ctrs(groups[denom])))
 
         counter_sets = []
-        current_set = set()
-
-        for denom in groups.keys():
-            # Make a copy of the list because we're going to mutate it
-            numerators = groups[denom].copy()
-            while len(numerators):
-                # Make sure to add the denominator to the set, if and only if
-                # it is not there and we have space for another numerator.
-                # One exception is for counter ratios with no denominator.
-                if (denom) and (denom not in current_set):
-                    if len(current_set) < (MAX_COUNTERS_IN_GROUP - 1):
-                        current_set.add(denom)
-                    else:
-                        # Counter set cannot fit a new denominator and
-                        # at least 1 numerator in group
-                        counter_sets.append(current_set)
-                        current_set = set()
+        for denom in denoms:
+            for numer in groups[denom]:
+                needed = [ctr for ctr in (denom, numer) if ctr is not None]
+                best = None
+                best_cost = None
+                for current_set in counter_sets:
+                    used = general_ctrs(current_set)
+                    cost = general_ctrs(current_set | set(needed)) - used
+                    if used + cost > MAX_COUNTERS_IN_GROUP:
                         continue
+                    if best is None or cost < best_cost:
+                        best = current_set
+                        best_cost = cost
 
-                if len(current_set) < MAX_COUNTERS_IN_GROUP:
-                    current_set.add(numerators.pop(0))
-                else:
-                    # Out of space for a numerator
-                    counter_sets.append(current_set)
-                    current_set = set()
-
-        # Add final counter set.
-        if len(current_set):
-            counter_sets.append(current_set)
-        if pmu not in pmu_sets:
-            pmu_sets[pmu] = counter_sets
-        else:
-            pmu_sets[pmu].extend(counter_sets)
+                if best is None:
+                    # No group has room, a ratio too large for any group still gets one
+                    best = set()
+                    counter_sets.append(best)
+                best.update(needed)
+
+        for current_set in counter_sets:
+            if general_ctrs(current_set) > MAX_COUNTERS_IN_GROUP:
+                raise ValueError(f"A {pmu} group needs more than {MAX_COUNTERS_IN_GROUP} general purpose "
+                                 f"counters: {sorted(ctr.get_canonical_name() for ctr in current_set)}")
+
+        pmu_sets[pmu] = counter_sets
 
     return pmu_sets
 
 
+def group_duty_cycles(counter_groups, runtime):
+    """
+    The groups of each PMU take turns counting for SAMPLE_INTERVAL until the runtime is
+    over, every PMU at the same time.  Returns a dict with the fraction of time each
+    group of a PMU counts for and how many samples of each group to expect in runtime
+    seconds.
+    """
+    duty_cycles = {}
+    for pmu, counter_sets in counter_groups.items():
+        if not counter_sets:
+            continue
+        rotation = len(counter_sets) * SAMPLE_INTERVAL
+        # A rotation that has started when the runtime is over is finished
+        duty_cycles[pmu] = (1.0 / len(counter_sets), math.ceil(runtime / rotation))
+    return duty_cycles
+
+
+def print_schedule(counter_groups, runtime):
+    """
+    Prints the counters of every group and what share of the runtime each is measured
+    """
+    duty_cycles = group_duty_cycles(counter_groups, runtime)
+    for pmu, named in name_groups(counter_groups).items():
+        for group, ctrset in named:
+            names = ", ".join(sorted(ctr.get_canonical_name() for ctr in ctrset))
+            print(f"{group} ({pmu}): {names}")
+        if pmu in duty_cycles:
+            duty_cycle, samples = duty_cycles[pmu]
+            print(f"Each of {len(named)} {pmu} groups counts {duty_cycle * 100:.1f}% of the time, "
+                  f"{samples} samples of {SAMPLE_INTERVAL}s each over {runtime}s")
+
+
 def get_cpu_type():
     GRAVITON_MAPPING = {
         "0xd0c": "Graviton2",
@@ -561,17 +1243,34 @@ def get_cpu_type():
 
 
 class PlatformDetails:
-    def __init__(self, counter_list, max_ctrs):
+    def __init__(self, counter_list, max_ctrs, fixed_ctrs=None):
         self.counter_list = copy.deepcopy(counter_list)
         self.max_ctrs = max_ctrs
+        # Events programmed on fixed counters, they do not count against max_ctrs
+        self.fixed_ctrs = fixed_ctrs or []
 
     def get_max_ctrs(self) -> int:
         return self.max_ctrs
 
+    def get_fixed_ctrs(self) -> list:
+        # The NMI watchdog holds the cycle counter while it runs, cycles then takes a
+        # general purpose counter like any other event
+        if nmi_watchdog_enabled():
+            return [ctr for ctr in self.fixed_ctrs if ctr not in CYCLE_CTRS]
+        return self.fixed_ctrs
+
     def get_counters(self) -> list:
         return self.counter_list
 
 
+# Events with a dedicated counter, the Arm PMUv3 cycle counter and Intel's fixed
+# instructions retired and unhalted core cycles counters
+ARM_FIXED_CTRS = ["event=0x11"]
+INTEL_FIXED_CTRS = ["event=0xc0,umask=0x0", "event=0x3c,umask=0x0"]
+# The cycle counters of those, the ones the NMI watchdog counts on
+CYCLE_CTRS = ["event=0x11", "event=0x3c,umask=0x0"]
+
+
 def _agg_gv5_l3_misses(x):
     x = x.to_list()
     sz = len(x)
@@ -805,9 +1504,9 @@ def create_graviton_counter_mapping(cpu_type):
 
     pmu_groups = []
     if have_pmu:
-        pmu_groups.append(PlatformDetails(counter_mapping["Graviton"], 6))
+        pmu_groups.append(PlatformDetails(counter_mapping["Graviton"], 6, ARM_FIXED_CTRS))
         if cpu_type in counter_mapping:
-            pmu_groups.append(PlatformDetails(counter_mapping[cpu_type], 6))
+            pmu_groups.append(PlatformDetails(counter_mapping[cpu_type], 6, ARM_FIXED_CTRS))
     if have_cmn:
         if cpu_type != "Graviton4":
             pmu_groups.append(PlatformDetails(counter_mapping["CMN"], 2))
@@ -825,26 +1524,26 @@ filter_proc = {
     "Graviton4": create_graviton_counter_mapping("Graviton4"),
     "Graviton5": create_graviton_counter_mapping("Graviton5"),
     "Intel(R) Xeon(R) Platinum 8124M CPU @ 3.00GHz": [
-        PlatformDetails(counter_mapping["Intel_SKX_CXL_ICX"], 4),
-        PlatformDetails(counter_mapping["Intel_SKX_CXL"], 4)],
+        PlatformDetails(counter_mapping["Intel_SKX_CXL_ICX"], 4, INTEL_FIXED_CTRS),
+        PlatformDetails(counter_mapping["Intel_SKX_CXL"], 4, INTEL_FIXED_CTRS)],
     "Intel(R) Xeon(R) Platinum 8175M CPU @ 2.50GHz": [
-        PlatformDetails(counter_mapping["Intel_SKX_CXL_ICX"], 4),
-        PlatformDetails(counter_mapping["Intel_SKX_CXL"], 4)],
+        PlatformDetails(counter_mapping["Intel_SKX_CXL_ICX"], 4, INTEL_FIXED_CTRS),
+        PlatformDetails(counter_mapping["Intel_SKX_CXL"], 4, INTEL_FIXED_CTRS)],
     "Intel(R) Xeon(R) Platinum 8275CL CPU @ 3.00GHz": [
-        PlatformDetails(counter_mapping["Intel_SKX_CXL_ICX"], 4),
-        PlatformDetails(counter_mapping["Intel_SKX_CXL"], 4)],
+        PlatformDetails(counter_mapping["Intel_SKX_CXL_ICX"], 4, INTEL_FIXED_CTRS),
+        PlatformDetails(counter_mapping["Intel_SKX_CXL"], 4, INTEL_FIXED_CTRS)],
     "Intel(R) Xeon(R) Platinum 8259CL CPU @ 2.50GHz": [
-        PlatformDetails(counter_mapping["Intel_SKX_CXL_ICX"], 4),
-        PlatformDetails(counter_mapping["Intel_SKX_CXL"], 4)],
+        PlatformDetails(counter_mapping["Intel_SKX_CXL_ICX"], 4, INTEL_FIXED_CTRS),
+        PlatformDetails(counter_mapping["Intel_SKX_CXL"], 4, INTEL_FIXED_CTRS)],
     "Intel(R) Xeon(R) Platinum 8375C CPU @ 2.90GHz": [
-        PlatformDetails(counter_mapping["Intel_SKX_CXL_ICX"], 6),
-        PlatformDetails(counter_mapping["Intel_ICX"], 6)],
+        PlatformDetails(counter_mapping["Intel_SKX_CXL_ICX"], 6, INTEL_FIXED_CTRS),
+        PlatformDetails(counter_mapping["Intel_ICX"], 6, INTEL_FIXED_CTRS)],
     "Intel(R) Xeon(R) Platinum 8488C": [
-        PlatformDetails(counter_mapping["Intel_SKX_CXL_ICX"], 6),
-        PlatformDetails(counter_mapping["Intel_SPR"], 6)],
+        PlatformDetails(counter_mapping["Intel_SKX_CXL_ICX"], 6, INTEL_FIXED_CTRS),
+        PlatformDetails(counter_mapping["Intel_SPR"], 6, INTEL_FIXED_CTRS)],
     "Intel(R) Xeon(R) 6975P-C": [
-        PlatformDetails(counter_mapping["Intel_SKX_CXL_ICX"], 6),
-        PlatformDetails(counter_mapping["Intel_SPR"], 6)],
+        PlatformDetails(counter_mapping["Intel_SKX_CXL_ICX"], 6, INTEL_FIXED_CTRS),
+        PlatformDetails(counter_mapping["Intel_SPR"], 6, INTEL_FIXED_CTRS)],
     "Milan": [
         PlatformDetails(counter_mapping["Milan_Genoa"], 6),
         PlatformDetails(counter_mapping["Milan"], 6)],
@@ -861,8 +1560,27 @@ if __name__ == "__main__":
     parser.add_argument("--no-root", action="store_true", help="Allow running without root privileges")
     parser.add_argument("--cpu-list", action="store", type=str)
     parser.add_argument("--timeout", action="store", type=int, default=300)
+    parser.add_argument("--engine", choices=["perf", "native"], default="perf",
+                        help="Collect with perf-stat, or program the counters with perf_event_open directly")
+    parser.add_argument("--converge", action="store", type=float,
+                        help="Stop before --timeout once the means over the group windows of the p50 and p99 "
+                             "over the CPUs of every stat are known within this relative error, e.g. 0.05")
+    subparsers = parser.add_subparsers(dest="command")
+    compare_parser = subparsers.add_parser("compare", help="Compare the stats of baseline and candidate runs")
+    compare_parser.add_argument("--baseline", nargs="+", required=True,
+                                help=f"{RESULTS_JSON} files of the baseline runs")
+    compare_parser.add_argument("--candidate", nargs="+", required=True,
+                                help=f"{RESULTS_JSON} files of the candidate runs")
+    compare_parser.add_argument("--metric", default="geomean", choices=["geomean"] + list(STAT_PERCENTILES),
+                                help="Stat value to compare")
+    compare_parser.add_argument("--alpha", type=float, default=COMPARE_ALPHA,
+                                help="Significance level of the differences reported")
     args = parser.parse_args()
 
+    if args.command == "compare":
+        print_comparison(*compare_results(args.baseline, args.candidate, args.metric, args.alpha))
+        exit(0)
+
     if not args.no_root:
         res = subprocess.run(["id", "-u"], check=True, stdout=subprocess.PIPE)
         if int(res.stdout) > 0:
@@ -871,13 +1589,17 @@ if __name__ == "__main__":
 
     # Remove temporary files
     try:
-        os.remove(RESULTS_CSV)
+        os.remove(RESULTS_ARROW)
     except:
         pass
     try:
         os.remove(RESULTS_JSON)
     except:
         pass
+    try:
+        os.remove(RESULTS_BREAKDOWN_JSON)
+    except:
+        pass
 
     cpus = None
     if args.cpu_list and args.cpu_list != "all":
@@ -891,10 +1613,24 @@ if __name__ == "__main__":
         print(f"Error: {processor_version} not supported")
         exit(1)
 
-    # For Graviton single-slot, max counters - 1 is what avoids odd aliasing with the Brimstone cycle counter.
+    if nmi_watchdog_enabled():
+        print("The NMI watchdog holds the cycle counter, cycles takes a general purpose counter in each group. "
+              "Disable it with 'sysctl kernel.nmi_watchdog=0' for fewer groups.")
     counter_groups = build_groups(counters)
-
-    perfstat(counter_groups, timeout=args.timeout, cpus=cpus)
+    print_schedule(counter_groups, args.timeout)
+
+    monitor = None
+    if args.converge:
+        monitor = ConvergenceMonitor(counters, args.converge)
+
+    if args.engine == "native":
+        perf_event_stat(counter_groups, timeout=args.timeout, cpus=cpus, monitor=monitor)
+    else:
+        perfstat(counter_groups, timeout=args.timeout, cpus=cpus, monitor=monitor)
+    if monitor and monitor.converged:
+        print(f"Every stat converged after {monitor.elapsed:.0f}s")
     counter_table = calculate_counter_stat(counters)
 
     pretty_print_table(counter_table)
+    with open(RESULTS_BREAKDOWN_JSON) as f:
+        print_outliers(json.load(f))
@@ -5,10 +5,11 @@ import argparse
 import pandas as pd
 import numpy as np
 import re
-from scipy import stats
 import subprocess
 import io
 
+from quantile_sketch import DDSketch
+
 # When calculating aggregate stats, if some are zero, may
 # get a benign divide-by-zero warning from numpy, make it silent.
 np.seterr(divide='ignore')
@@ -83,10 +84,12 @@ def plot_counter_stat(csv, logfile, plot, stat_name, counter_numerator,
     df_processed.dropna(inplace=True)
 
     # Calculate some meaningful aggregate stats for comparing time-series plots
-    geomean = stats.gmean(df_processed[stat_name])
-    p50 = stats.scoreatpercentile(df_processed[stat_name], 50)
-    p90 = stats.scoreatpercentile(df_processed[stat_name], 90)
-    p99 = stats.scoreatpercentile(df_processed[stat_name], 99)
+    sketch = DDSketch()
+    sketch.add(df_processed[stat_name])
+    geomean = sketch.geomean()
+    p50 = sketch.quantile(0.50)
+    p90 = sketch.quantile(0.90)
+    p99 = sketch.quantile(0.99)
     xtitle = f"gmean:{geomean:>6.2f} p50:{p50:>6.2f} p90:{p90:>6.2f} p99:{p99:>6.2f}"
 
     if logfile:
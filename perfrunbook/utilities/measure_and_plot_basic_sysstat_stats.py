@@ -8,25 +8,30 @@ import subprocess
 
 import numpy as np
 import pandas as pd
-from scipy import stats
 
 # When calculating aggregate stats, if some are zero, may
 # get a benign divide-by-zero warning from numpy, make it silent.
 np.seterr(divide='ignore')
 pd.options.mode.chained_assignment = None
 
+# Decode sadc data files with sa_file_parse instead of parsing the text sar -f renders
+# of them, set with --decode-sa.  Off by default until the decoder has been validated
+# against the data files of every supported sysstat release.
+decode_sa_files = False
+
 
 def sar(time):
     """
-    Measure sar into a buffer for parsing
+    Measure sar into a buffer holding the binary sadc data file for parsing
     """
     try:
         env = dict(os.environ, S_TIME_FORMAT="ISO", LC_TIME="ISO")
         res = subprocess.run(["sar", "-o", "out.dat", "-A", "1", f"{time}"], timeout=time+5, env=env,
                              check=True, stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
-        res = subprocess.run(["sar", "-f", "out.dat", "-A", "1"], env=env, check=True, stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+        with open("out.dat", "rb") as f:
+            buf = io.BytesIO(f.read())
         os.remove("out.dat")
-        return io.StringIO(res.stdout.decode('utf-8'))
+        return buf
     except subprocess.CalledProcessError:
         print("Failed to measure statistics with sar.")
         print("Please check that sar is installed using install_perfrunbook_dependencies.sh and is in your PATH")
@@ -68,7 +73,9 @@ def calc_stats_and_plot(df, stat, yaxis_range=None):
     Function that calculates the common stats and 
     plots the data.
     """
-    df['time_delta'] = (df.index - df.index[0]).seconds
+    from quantile_sketch import DDSketch
+
+    df['time_delta'] = (df.index - df.index[0]).total_seconds()
     df = df.set_index('time_delta')
 
     if yaxis_range:
@@ -77,20 +84,53 @@ def calc_stats_and_plot(df, stat, yaxis_range=None):
         limit = (0, df[stat].max() + 1)
 
     # Calculate some meaningful aggregate stats for comparing time-series plots
-    geomean = stats.gmean(df[stat])
-    p50 = stats.scoreatpercentile(df[stat], 50)
-    p90 = stats.scoreatpercentile(df[stat], 90)
-    p99 = stats.scoreatpercentile(df[stat], 99)
+    sketch = DDSketch()
+    sketch.add(df[stat])
+    geomean = sketch.geomean()
+    p50 = sketch.quantile(0.50)
+    p90 = sketch.quantile(0.90)
+    p99 = sketch.quantile(0.99)
     xtitle = f"gmean:{geomean:>6.2f} p50:{p50:>6.2f} p90:{p90:>6.2f} p99:{p99:>6.2f}"
 
     plot_terminal(df, stat, xtitle, limit)
 
 
+def sar_text(buf):
+    """
+    Render a binary sadc data file to sar's text output
+    """
+    import tempfile
+    env = dict(os.environ, S_TIME_FORMAT="ISO", LC_TIME="ISO")
+    with tempfile.NamedTemporaryFile(suffix=".dat") as f:
+        f.write(buf.getvalue())
+        f.flush()
+        res = subprocess.run(["sar", "-f", f.name, "-A", "1"], env=env, check=True, stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+    return io.StringIO(res.stdout.decode('utf-8'))
+
+
 def parse_sar(sar_parse_class, buf):
     """
     Parse SAR output to a pandas dataframe
     """
-    from sar_parse import parse_start_date
+    from sar_parse import parse_start_date, SectionDispatcher
+    from sa_file_parse import parse_sa_file, UnsupportedFormat
+
+    # Already parsed, e.g. by the live collector
+    if isinstance(buf, pd.DataFrame):
+        return buf
+
+    # With --decode-sa, decode the binary data file directly when we understand its
+    # format and it holds the section, otherwise let sar render it and parse the text
+    if isinstance(buf, io.BytesIO):
+        if decode_sa_files:
+            try:
+                df = parse_sa_file(buf, save_parquet=False).get(sar_parse_class.name)
+                if df is not None:
+                    return df
+            except UnsupportedFormat:
+                pass
+        buf = sar_text(buf)
+
     line = buf.readline()
     start_date = parse_start_date(line)
     if not start_date:
@@ -98,15 +138,11 @@ def parse_sar(sar_parse_class, buf):
         exit(1)
 
     parse = sar_parse_class(start_date)
-    line = buf.readline()
-    df = None
-    while(line):
-        df = parse.parse_for_header(line, buf, save_parquet=False)
-        if (df is not None):
-            break
-        line = buf.readline()
-    
-    return df
+    dispatcher = SectionDispatcher([parse])
+    dispatcher.parse(buf)
+    frames = dispatcher.finish(save_parquet=False)
+
+    return frames.get(parse.name)
 
 
 def plot_cpu(buf, stat):
@@ -149,10 +185,7 @@ def plot_irq(buf, stat):
     Plot irq per second data from mpstat
     """
     from mpstat_parse import parse_mpstat_json_all_irqs
-    import json
-    irqs = json.load(buf)
-
-    df = parse_mpstat_json_all_irqs(irqs)
+    df = buf if isinstance(buf, pd.DataFrame) else parse_mpstat_json_all_irqs(buf)
 
     calc_stats_and_plot(df, stat)
 
@@ -161,15 +194,12 @@ def plot_specific_irq(buf, stat):
     """
     Plot a specific IRQ source
     """
-    import json
-    irqs = json.load(buf)
-
     # IPI0 - rescheduling interrupt
     # IPI1 - Function call interrupt
     # RES - rescheduling interrupt x86
     # CAL - function call interrupt x86
     from mpstat_parse import parse_mpstat_json_single_irq
-    df = parse_mpstat_json_single_irq(irqs, stat)
+    df = buf if isinstance(buf, pd.DataFrame) else parse_mpstat_json_single_irq(buf, stat)
 
     calc_stats_and_plot(df, stat)
 
@@ -186,6 +216,42 @@ stat_mapping = {
   "single-irq": (mpstat, plot_specific_irq, ""),
 }
 
+# Section of the live collector and proc sampler frames each plot reads
+plot_sections = {
+  plot_cpu: "cpu",
+  plot_tcp: "tcp",
+  plot_cswitch: "cswch",
+  plot_irq: "irq",
+  plot_specific_irq: "irq",
+}
+
+
+def live(gather, plot, stat, time, refresh=5):
+    """
+    Collect with sar or mpstat in the background and redraw the plot every refresh
+    seconds from the records received so far
+    """
+    import asyncio
+    import plotext as plt
+    from live_sysstat import LiveCollector
+
+    collector = LiveCollector()
+    name = plot_sections[plot]
+
+    async def run():
+        task = asyncio.ensure_future(collector.sar(time) if gather is sar else collector.mpstat(time))
+        while not task.done():
+            await asyncio.wait([task], timeout=refresh)
+            df = collector.frame(name)
+            if len(df) > 1 and (stat in df.columns or plot is plot_cpu):
+                plt.clear_terminal()
+                plt.clear_data()
+                plot(df, stat)
+        return await task
+
+    return asyncio.run(run())
+
+
 if __name__ == "__main__":
     parser = argparse.ArgumentParser()
     parser.add_argument("--stat", default="cpu-user", type=str, choices=["cpu-user", "cpu-kernel", "cpu-iowait", 
@@ -193,8 +259,16 @@ if __name__ == "__main__":
                                                                          "cswitch","all-irqs","single-irq"])
     parser.add_argument("--irq", type=str, help="Specific IRQ to measure if single-irq chosen for stat")
     parser.add_argument("--time", default=60, type=int, help="How long to measure for in seconds")
+    parser.add_argument("--live", action="store_true", help="Update the plot while measuring")
+    parser.add_argument("--source", default="sysstat", type=str, choices=["sysstat", "proc"],
+                        help="Measure with sar and mpstat, or sample /proc directly")
+    parser.add_argument("--interval", default=0.1, type=float,
+                        help="Seconds between samples with --source proc")
+    parser.add_argument("--decode-sa", action="store_true",
+                        help="Decode sar's binary data file directly instead of parsing sar -f text (experimental)")
 
     args = parser.parse_args()
+    decode_sa_files = args.decode_sa
 
     gather, plot, stat = stat_mapping[args.stat]
 
@@ -204,5 +278,14 @@ if __name__ == "__main__":
         print("single-irq selected, need to specify --irq option")
         exit(1)
 
+    if args.source == "proc":
+        from proc_sampler import sample_proc
+        frames = sample_proc(args.time, args.interval)
+        plot(frames[plot_sections[plot]], stat)
+        exit(0)
+
+    if args.live:
+        exit(live(gather, plot, stat, args.time))
+
     text = gather(args.time)
     plot(text, stat)
@@ -1,9 +1,16 @@
 #!/opt/perfrunbook-venv/bin/python3
 
+import array
+import json
+import re
 import numpy as np
 import pandas as pd
 
 
+STATISTICS_START = re.compile(r'''"statistics"\s*:\s*\[''')
+HOST_DATE = re.compile(r'''"date"\s*:\s*"(?P<date>[^"]*)"''')
+
+
 # Pass in a dict s:
 # { date: string in YYYY-MM-DD
 #   time: string in hh:mm:ss
@@ -12,7 +19,7 @@ import pandas as pd
 # Returns a np.datetime64 object
 def parse_time(time, last_date):
     # Get ourselves a date in ISO format from last_date
-    date = f"{last_date.tolist().year}-{last_date.tolist().month:02d}-{last_date.tolist().day:02d}"
+    date = str(last_date.astype('datetime64[D]'))
     d = np.datetime64(f"{date} {time}")
     if last_date:
         while (d - last_date) < np.timedelta64(0, 's'):
@@ -21,31 +28,180 @@ def parse_time(time, last_date):
     return d
 
 
-def parse_mpstat_json_all_irqs(data):
+# Pass in a list of hh:mm:ss strings
+# Returns a (len x 8) array of their characters, raises ValueError for any other format
+# instead of truncating or misreading it, e.g. a 12 hour clock without S_TIME_FORMAT=ISO
+def time_chars(timestamps):
+    stamps = np.array(timestamps, dtype=np.bytes_)
+    if not len(stamps):
+        return np.zeros((0, 8), dtype=np.uint8)
+    chars = np.zeros((len(stamps), 8), dtype=np.uint8)
+    if stamps.dtype.itemsize == 8:
+        chars = stamps.view(np.uint8).reshape(-1, 8)
+    digits = chars[:, [0, 1, 3, 4, 6, 7]]
+    bad = (((digits < ord('0')) | (digits > ord('9'))).any(axis=1) |
+           (chars[:, 2] != ord(':')) | (chars[:, 5] != ord(':')))
+    if bad.any():
+        raise ValueError(f"timestamp {timestamps[int(np.argmax(bad))]!r} is not in hh:mm:ss format")
+    return chars
+
+
+# Pass in the date of the first sample in YYYY-MM-DD and a list of hh:mm:ss strings
+# Returns an array of np.datetime64 objects, rolling samples over midnight
+def parse_times(date, timestamps):
+    digits = time_chars(timestamps).astype(np.int64) - ord('0')
+    secs = ((digits[:, 0] * 10 + digits[:, 1]) * 3600 +
+            (digits[:, 3] * 10 + digits[:, 4]) * 60 +
+            (digits[:, 6] * 10 + digits[:, 7]))
+
+    # Every time the clock goes backwards we crossed midnight
+    days = np.zeros(len(secs), dtype=np.int64)
+    days[1:] = np.cumsum(secs[1:] < secs[:-1])
+    return np.datetime64(date, 's') + (secs + days * 86400).astype('timedelta64[s]')
+
+
+class MpstatStatisticsDecoder(object):
     """
-    Parses IRQs for entire system
+    Incrementally decodes the entries of sysstat.hosts[].statistics out of an mpstat
+    -o JSON document handed over in pieces, e.g. as mpstat prints them
     """
-    irq_data = data["sysstat"]["hosts"][0]["statistics"]
-    date = data["sysstat"]["hosts"][0]["date"]
 
-    data = {"time": [],
-            "irq_s": []}
-
-    last_date = None
-    for stats in irq_data:
-        timestamp = stats["timestamp"]
-        all_irqs = float(stats["sum-interrupts"][0]["intr"])
-
-        if last_date:
-            date = parse_time(timestamp, last_date)
-        else:
-            date = np.datetime64(f"{date} {timestamp}")
-        last_date = date
+    def __init__(self):
+        self.decoder = json.JSONDecoder()
+        self.buf = ""
+        self.date = None
+        self.in_statistics = False
+
+    # Characters buffered that do not complete a statistics entry yet
+    def pending(self):
+        return len(self.buf)
+
+    # Add the next piece of the document, returns the (host date, entry) pairs it completes
+    def feed(self, text):
+        buf = self.buf + text
+        pos = 0
+        entries = []
+        while True:
+            if not self.in_statistics:
+                # Keep the host header buffered until its statistics start
+                match = STATISTICS_START.search(buf, pos)
+                if match is None:
+                    break
+                dates = HOST_DATE.findall(buf, pos, match.start())
+                self.date = dates[-1] if dates else self.date
+                pos = match.end()
+                self.in_statistics = True
+                continue
+
+            while pos < len(buf) and buf[pos] in " \t\r\n,":
+                pos += 1
+            if pos == len(buf):
+                break
+            if buf[pos] == "]":
+                pos += 1
+                self.in_statistics = False
+                continue
+            try:
+                stats, pos = self.decoder.raw_decode(buf, pos)
+            except json.JSONDecodeError:
+                break
+            entries.append((self.date, stats))
+
+        self.buf = buf[pos:]
+        return entries
+
+    def close(self):
+        if self.in_statistics:
+            raise ValueError("mpstat JSON ends inside the statistics of a host")
+
+
+def iter_mpstat_statistics(data, chunk_size=1 << 16):
+    """
+    Yields the host date and every entry of sysstat.hosts[].statistics.  data is either
+    the document loaded with json.load, the (host date, entry) pairs returned by
+    MpstatStatisticsDecoder.feed or a file object, which is decoded one entry at a time
+    so memory stays proportional to a sample instead of the whole document.
+    """
+    if isinstance(data, dict):
+        for host in data["sysstat"]["hosts"]:
+            for stats in host["statistics"]:
+                yield host["date"], stats
+        return
+    if isinstance(data, list):
+        yield from data
+        return
+
+    decoder = MpstatStatisticsDecoder()
+    while True:
+        # Read at least as much as is buffered so decoding a large entry stays linear
+        chunk = data.read(max(chunk_size, decoder.pending()))
+        if not chunk:
+            break
+        yield from decoder.feed(chunk)
+    decoder.close()
+
+
+def parse_mpstat_json_irq_matrix(data, irqs=None):
+    """
+    Parses the individual-interrupts of every sample in one pass.  Returns the sample
+    times, the CPU names, the IRQ names and a (time x CPU x IRQ) array of interrupts per
+    second.  With irqs only those IRQ names are kept, IRQs a CPU does not report are 0.
+    """
+    dates = []
+    timestamps = []
+    cpus = {}
+    names = {} if irqs is None else {irq: i for i, irq in enumerate(irqs)}
+    sample_idx = array.array('i')
+    cpu_idx = array.array('i')
+    irq_idx = array.array('i')
+    values = array.array('d')
+
+    for sample, (date, stats) in enumerate(iter_mpstat_statistics(data)):
+        dates.append(date)
+        timestamps.append(stats["timestamp"])
+        for cpu in stats["individual-interrupts"]:
+            c = cpus.setdefault(cpu["cpu"], len(cpus))
+            for irq in cpu["intr"]:
+                i = names.get(irq["name"])
+                if i is None:
+                    if irqs is not None:
+                        continue
+                    i = names[irq["name"]] = len(names)
+                sample_idx.append(sample)
+                cpu_idx.append(c)
+                irq_idx.append(i)
+                values.append(irq["value"])
+
+    matrix = np.zeros((len(timestamps), len(cpus), len(names)))
+    # A CPU can report several IRQs of the same name, add them up instead of keeping the last
+    np.add.at(matrix, (np.frombuffer(sample_idx, dtype=np.int32), np.frombuffer(cpu_idx, dtype=np.int32),
+                       np.frombuffer(irq_idx, dtype=np.int32)), np.frombuffer(values))
+    times = parse_times(dates[0], timestamps) if timestamps else np.array([], dtype='datetime64[s]')
+    return times, list(cpus), list(names), matrix
+
+
+def irq_totals(matrix):
+    """
+    Sums a (time x CPU x IRQ) array of parse_mpstat_json_irq_matrix over the CPUs into
+    a (time x IRQ) array, every CPU's rate is truncated to an integer before summing
+    """
+    return np.trunc(matrix).astype(np.int64).sum(axis=1)
 
-        data["time"].append(date)
-        data["irq_s"].append(all_irqs)
 
-    df = pd.DataFrame(data)
+def parse_mpstat_json_all_irqs(data):
+    """
+    Parses IRQs for entire system
+    """
+    dates = []
+    timestamps = []
+    irq_s = []
+    for date, stats in iter_mpstat_statistics(data):
+        dates.append(date)
+        timestamps.append(stats["timestamp"])
+        irq_s.append(float(stats["sum-interrupts"][0]["intr"]))
+
+    times = parse_times(dates[0], timestamps) if timestamps else np.array([], dtype='datetime64[s]')
+    df = pd.DataFrame({"time": times, "irq_s": irq_s})
     df = df.set_index('time')
     return df
 
@@ -54,28 +210,43 @@ def parse_mpstat_json_single_irq(data, irq):
     """
     Does the generic parsing and combining
     """
-    irq_data = data["sysstat"]["hosts"][0]["statistics"]
-    date = data["sysstat"]["hosts"][0]["date"]
-
-    data = {"time": []}
-    data[irq] = []
-
-    last_date = None
-    for stats in irq_data:
-        timestamp = stats["timestamp"]
-
-        single_irq = 0
-        for cpus in stats["individual-interrupts"]:
-            for irqs in cpus["intr"]:
-                if irqs["name"] == irq:
-                    single_irq += int(irqs["value"])
-        if last_date:
-            date = parse_time(timestamp, last_date)
-        else:
-            date = np.datetime64(f"{date} {timestamp}")
-        last_date = date
-        data["time"].append(date)
-        data[irq].append(single_irq)
-    df = pd.DataFrame(data)
+    times, cpus, names, matrix = parse_mpstat_json_irq_matrix(data, irqs=[irq])
+
+    df = pd.DataFrame({"time": times, irq: irq_totals(matrix)[:, 0]})
     df = df.set_index('time')
     return df
+
+
+def parse_mpstat_json_irqs(data, irqs=None):
+    """
+    Parses every IRQ on every CPU in one pass.  Returns a frame indexed by time with
+    (irq, cpu) columns of interrupts per second, e.g. df["IPI1"] is the function call
+    IPIs of each CPU and df.xs("0", axis=1, level="cpu") every IRQ of CPU 0.
+    """
+    times, cpus, names, matrix = parse_mpstat_json_irq_matrix(data, irqs=irqs)
+
+    # Lay the CPUs of each IRQ next to each other
+    values = matrix.transpose(0, 2, 1).reshape(len(times), len(names) * len(cpus))
+    columns = pd.MultiIndex.from_product([names, cpus], names=["irq", "cpu"])
+    df = pd.DataFrame(values, index=pd.Index(times, name='time'), columns=columns)
+    return df
+
+
+def top_irqs(df, n=10):
+    """
+    Ranks the IRQs of a parse_mpstat_json_irqs frame by their mean rate summed over
+    all CPUs, returns the n busiest
+    """
+    rates = df.T.groupby(level="irq", sort=False).sum().T
+    return rates.mean().nlargest(n)
+
+
+def top_cpus(df, n=10, irq=None):
+    """
+    Ranks the CPUs of a parse_mpstat_json_irqs frame by their mean rate of all IRQs, or
+    of irq only, returns the n busiest
+    """
+    if irq is not None:
+        df = df[[irq]]
+    rates = df.T.groupby(level="cpu", sort=False).sum().T
+    return rates.mean().nlargest(n)
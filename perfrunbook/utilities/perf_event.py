@@ -0,0 +1,206 @@
+#!/opt/perfrunbook-venv/bin/python3
+
+import ctypes
+import fcntl
+import os
+import platform
+import re
+import struct
+
+# Minimal ctypes binding of perf_event_open(2), enough to program the counter groups
+# measure_aggregated_pmu_stats.py builds, enable and disable them ourselves and read
+# every counter of a group at once with the PERF_FORMAT_GROUP read format.
+#
+# Events are given in the syntax perf-stat takes, pmu/term=value,...,name=label/, and
+# the terms are encoded into the event attributes with the format descriptions the
+# kernel publishes under /sys/bus/event_source/devices/<pmu>/format.
+
+EVENT_SOURCE_DEVICES = "/sys/bus/event_source/devices"
+
+SYSCALL_PERF_EVENT_OPEN = {
+    "x86_64": 298,
+    "aarch64": 241,
+}
+
+PERF_EVENT_IOC_ENABLE = 0x2400
+PERF_EVENT_IOC_DISABLE = 0x2401
+PERF_IOC_FLAG_GROUP = 1
+
+PERF_FORMAT_TOTAL_TIME_ENABLED = 1 << 0
+PERF_FORMAT_TOTAL_TIME_RUNNING = 1 << 1
+PERF_FORMAT_GROUP = 1 << 3
+
+# Bit of the disabled flag in the flags bitfield of perf_event_attr
+ATTR_DISABLED = 1 << 0
+
+EVENT_STRING = re.compile(r'''(?P<pmu>[^/,]+)/(?P<terms>[^/]*)/''')
+
+
+class PerfEventAttr(ctypes.Structure):
+    # struct perf_event_attr up to config2 (PERF_ATTR_SIZE_VER1)
+    _fields_ = [
+        ("type", ctypes.c_uint32),
+        ("size", ctypes.c_uint32),
+        ("config", ctypes.c_uint64),
+        ("sample_period", ctypes.c_uint64),
+        ("sample_type", ctypes.c_uint64),
+        ("read_format", ctypes.c_uint64),
+        ("flags", ctypes.c_uint64),
+        ("wakeup_events", ctypes.c_uint32),
+        ("bp_type", ctypes.c_uint32),
+        ("config1", ctypes.c_uint64),
+        ("config2", ctypes.c_uint64),
+    ]
+
+
+_libc = ctypes.CDLL(None, use_errno=True)
+_libc.syscall.restype = ctypes.c_long
+
+
+def perf_event_open(attr, pid, cpu, group_fd, flags=0):
+    nr = SYSCALL_PERF_EVENT_OPEN.get(platform.machine())
+    if nr is None:
+        raise OSError("perf_event_open is not supported on {}".format(platform.machine()))
+    fd = _libc.syscall(ctypes.c_long(nr), ctypes.byref(attr), ctypes.c_int(pid), ctypes.c_int(cpu),
+                       ctypes.c_int(group_fd), ctypes.c_ulong(flags))
+    if fd < 0:
+        err = ctypes.get_errno()
+        raise OSError(err, "perf_event_open: {}".format(os.strerror(err)))
+    return fd
+
+
+class Pmu(object):
+    """
+    Type, event term formats and cpumask of a PMU as the kernel describes them in sysfs
+    """
+
+    cache = {}
+
+    @classmethod
+    def get(cls, name):
+        if name not in cls.cache:
+            cls.cache[name] = cls(name)
+        return cls.cache[name]
+
+    def __init__(self, name):
+        self.name = name
+        path = os.path.join(EVENT_SOURCE_DEVICES, name)
+        with open(os.path.join(path, "type")) as f:
+            self.type = int(f.read())
+
+        # term -> (attr field, [bits]), e.g. event -> ("config", [0, 1, ..., 15])
+        self.formats = {}
+        format_dir = os.path.join(path, "format")
+        if os.path.isdir(format_dir):
+            for term in os.listdir(format_dir):
+                with open(os.path.join(format_dir, term)) as f:
+                    field, _, ranges = f.read().strip().partition(":")
+                bits = []
+                for bit_range in ranges.split(","):
+                    low, _, high = bit_range.partition("-")
+                    bits.extend(range(int(low), int(high or low) + 1))
+                self.formats[term] = (field, bits)
+
+        # Uncore PMUs like the CMN can only be opened on the CPUs they list
+        self.cpus = None
+        cpumask = os.path.join(path, "cpumask")
+        if os.path.exists(cpumask):
+            with open(cpumask) as f:
+                self.cpus = parse_cpu_list(f.read().strip())
+
+    def attr(self, terms):
+        attr = PerfEventAttr()
+        attr.type = self.type
+        attr.size = ctypes.sizeof(PerfEventAttr)
+        for term, value in terms.items():
+            if term in ("config", "config1", "config2"):
+                setattr(attr, term, getattr(attr, term) | value)
+                continue
+            if term not in self.formats:
+                raise ValueError("{} has no event term {}".format(self.name, term))
+            field, bits = self.formats[term]
+            encoded = 0
+            for i, bit in enumerate(bits):
+                if value >> i & 1:
+                    encoded |= 1 << bit
+            setattr(attr, field, getattr(attr, field) | encoded)
+        return attr
+
+
+# Expand a list of CPUs like 0-3,8 into [0, 1, 2, 3, 8]
+def parse_cpu_list(cpu_list):
+    cpus = []
+    for cpu_range in cpu_list.split(","):
+        if cpu_range:
+            low, _, high = cpu_range.partition("-")
+            cpus.extend(range(int(low), int(high or low) + 1))
+    return cpus
+
+
+def parse_events(program):
+    """
+    Returns (pmu, name, terms) for every event of a perf event list like
+    armv8_pmuv3_0/event=0x8,name=group0-instructions/,armv8_pmuv3_0/event=0x11,name=group0-cycles/
+    """
+    events = []
+    for match in EVENT_STRING.finditer(program):
+        name = None
+        terms = {}
+        for term in match["terms"].split(","):
+            key, _, value = term.partition("=")
+            if key == "name":
+                name = value
+            elif key:
+                terms[key] = int(value, 0) if value else 1
+        events.append((Pmu.get(match["pmu"]), name, terms))
+    return events
+
+
+class EventGroup(object):
+    """
+    The events of one counter group opened on one CPU.  The group starts disabled, is
+    enabled and disabled as a whole and all its counters are read with one read().
+    """
+
+    def __init__(self, events, cpu):
+        self.names = [name for pmu, name, terms in events]
+        self.cpu = cpu
+        self.fds = []
+        try:
+            for pmu, name, terms in events:
+                attr = pmu.attr(terms)
+                attr.read_format = PERF_FORMAT_GROUP | PERF_FORMAT_TOTAL_TIME_ENABLED | PERF_FORMAT_TOTAL_TIME_RUNNING
+                if not self.fds:
+                    attr.flags = ATTR_DISABLED
+                self.fds.append(perf_event_open(attr, -1, cpu, self.fds[0] if self.fds else -1))
+        except Exception:
+            self.close()
+            raise
+        self.read_size = 8 * (3 + len(self.fds))
+        # Counts and times keep adding up over the life of the group, reads return deltas
+        self.enabled = 0
+        self.running = 0
+        self.values = [0] * len(self.fds)
+
+    def enable(self):
+        fcntl.ioctl(self.fds[0], PERF_EVENT_IOC_ENABLE, PERF_IOC_FLAG_GROUP)
+
+    def disable(self):
+        fcntl.ioctl(self.fds[0], PERF_EVENT_IOC_DISABLE, PERF_IOC_FLAG_GROUP)
+
+    # Returns the time the group was enabled and running in ns and the count of each
+    # event since the last read
+    def read(self):
+        data = os.read(self.fds[0], self.read_size)
+        nr, enabled, running = struct.unpack_from("QQQ", data)
+        values = struct.unpack_from("{}Q".format(nr), data, 24)
+        deltas = [value - last for value, last in zip(values, self.values)]
+        enabled, self.enabled = enabled - self.enabled, enabled
+        running, self.running = running - self.running, running
+        self.values = values
+        return enabled, running, deltas
+
+    def close(self):
+        for fd in reversed(self.fds):
+            os.close(fd)
+        self.fds = []
@@ -0,0 +1,295 @@
+#!/opt/perfrunbook-venv/bin/python3
+
+import argparse
+import os
+import time
+import numpy as np
+import pandas as pd
+
+# Samples the kernel counters sar and mpstat report straight out of /proc, for short
+# captures at intervals well below sar's 1 s.  The files are opened once and re-read
+# with pread, each sample parses their counters into arrays preallocated for the whole
+# capture and drops the text, so memory stays a few numbers per CPU and IRQ a sample
+# even on large hosts.  Turning counters into rates with NumPy happens once the capture
+# is over.  Pass root to read copies of the files, e.g. fixtures.
+
+PROC_FILES = {
+    "stat": "proc/stat",
+    "interrupts": "proc/interrupts",
+    "softirqs": "proc/softirqs",
+    "snmp": "proc/net/snmp",
+    "diskstats": "proc/diskstats",
+}
+
+# Columns of the cpu lines of /proc/stat
+STAT_CPU_FIELDS = ["user", "nice", "system", "idle", "iowait", "irq", "softirq", "steal", "guest", "guest_nice"]
+# Single counters of /proc/stat, like "ctxt 461994"
+STAT_COUNTERS = ["processes", "ctxt", "intr"]
+# Counters of the Tcp lines of /proc/net/snmp
+TCP_COUNTERS = ["ActiveOpens", "PassiveOpens", "InSegs", "OutSegs"]
+# Counters of /proc/diskstats summed over the devices: reads completed, sectors read,
+# writes completed, sectors written
+DISK_COUNTERS = ["reads", "sectors_read", "writes", "sectors_written"]
+
+# Samples preallocated when the number taken is not known up front
+SAMPLE_ROWS = 64
+
+
+def grow(data, axis, size):
+    """
+    Copy of data with axis grown to at least size, doubling it to keep appends cheap
+    """
+    shape = list(data.shape)
+    shape[axis] = max(size, 2 * shape[axis])
+    grown = np.zeros(shape, dtype=data.dtype)
+    grown[tuple(slice(0, n) for n in data.shape)] = data
+    return grown
+
+
+class Counters(object):
+    """
+    Counters of every sample in an array with a row per sample and a column per name,
+    grown as samples and names are added.  Names first seen in a later sample, like an
+    IRQ being registered, get a column holding 0 for the samples before.  width adds
+    trailing dimensions, e.g. the fields of each cpu line of /proc/stat.
+    """
+
+    def __init__(self, names=(), rows=SAMPLE_ROWS, width=(), dtype=np.int64):
+        self.names = {}
+        self.data = np.zeros((rows, max(len(names), 1)) + tuple(width), dtype=dtype)
+        self.columns(names)
+
+    # Column of each of names, adding columns for the ones not seen before
+    def columns(self, names):
+        columns = [self.names.setdefault(name, len(self.names)) for name in names]
+        if len(self.names) > self.data.shape[1]:
+            self.data = grow(self.data, 1, len(self.names))
+        return columns
+
+    def reserve(self, rows):
+        if rows > len(self.data):
+            self.data = grow(self.data, 0, rows)
+
+    def set(self, row, names, values):
+        columns = self.columns(names)
+        self.reserve(row + 1)
+        self.data[row, columns] = values
+
+    # Names and counters of the first rows samples
+    def values(self, rows):
+        return list(self.names), self.data[:rows, :len(self.names)]
+
+
+class ProcSampler(object):
+
+    def __init__(self, root="/", rows=SAMPLE_ROWS):
+        self.root = root
+        self.fds = {}
+        for name, path in PROC_FILES.items():
+            self.fds[name] = os.open(os.path.join(root, path), os.O_RDONLY)
+        self.sizes = {name: 1 << 16 for name in PROC_FILES}
+
+        # Only count whole devices, not their partitions, when we can tell them apart
+        block = os.path.join(root, "sys", "block")
+        self.devices = set(os.listdir(block)) if os.path.isdir(block) else None
+
+        self.count = 0
+        self.times = Counters(["time"], rows, dtype=np.float64)
+        self.cpu = Counters(rows=rows, width=(len(STAT_CPU_FIELDS),))
+        self.stat = Counters(STAT_COUNTERS, rows)
+        self.tcp = Counters(TCP_COUNTERS, rows)
+        self.disk = Counters(DISK_COUNTERS, rows)
+        # Totals over all CPUs of each row of /proc/interrupts and /proc/softirqs
+        self.totals = {"interrupts": Counters(rows=rows), "softirqs": Counters(rows=rows)}
+        # CPUs going on or offline change the cpu lines of /proc/stat, the ones of the
+        # last sample and the first sample they were seen in since
+        self.cpu_names = None
+        self.cpu_since = 0
+
+    # Whole contents of one of the files, growing the read size until it fits
+    def read(self, name):
+        while True:
+            data = os.pread(self.fds[name], self.sizes[name], 0)
+            if len(data) < self.sizes[name]:
+                return data
+            self.sizes[name] *= 2
+
+    # Make room for rows samples up front
+    def reserve(self, rows):
+        for counters in [self.times, self.cpu, self.stat, self.tcp, self.disk] + list(self.totals.values()):
+            counters.reserve(rows)
+
+    def sample(self):
+        now = time.time()
+        # Read every file before parsing any so the sample is as close to a snapshot as we get
+        data = {name: self.read(name) for name in self.fds}
+        row = self.count
+        self.times.set(row, ["time"], now)
+        self.parse_stat(row, data["stat"].decode())
+        self.parse_totals(row, "interrupts", data["interrupts"].decode())
+        self.parse_totals(row, "softirqs", data["softirqs"].decode())
+        self.parse_snmp(row, data["snmp"].decode())
+        self.parse_diskstats(row, data["diskstats"].decode())
+        self.count += 1
+
+    # Take a sample every interval seconds for duration seconds
+    def run(self, duration, interval=0.1):
+        start = time.monotonic()
+        count = int(duration / interval) + 1
+        self.reserve(self.count + count)
+        for i in range(count):
+            delay = start + i * interval - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+            self.sample()
+
+    def close(self):
+        for fd in self.fds.values():
+            os.close(fd)
+        self.fds = {}
+
+    def parse_stat(self, row, text):
+        names = []
+        ticks = []
+        counters = {}
+        for line in text.splitlines():
+            key, _, rest = line.partition(" ")
+            if key.startswith("cpu"):
+                names.append("all" if key == "cpu" else key[3:])
+                values = rest.split()[:len(STAT_CPU_FIELDS)]
+                # Older kernels print fewer fields
+                ticks.append(values + ["0"] * (len(STAT_CPU_FIELDS) - len(values)))
+            elif key in STAT_COUNTERS:
+                counters[key] = int(rest.split(None, 1)[0])
+
+        if names != self.cpu_names:
+            self.cpu_names = names
+            self.cpu_since = row
+        self.cpu.set(row, names, np.array(ticks, dtype=np.int64))
+        self.stat.set(row, list(counters), list(counters.values()))
+
+    def parse_totals(self, row, name, text):
+        lines = text.splitlines()
+        ncpu = len(lines[0].split())
+        totals = {}
+        for line in lines[1:]:
+            key, _, rest = line.partition(":")
+            counts = rest.split()[:ncpu]
+            # Rows like ERR and MIS have one count only, descriptions follow the counts
+            totals[key.strip()] = sum(int(count) for count in counts if count.isdigit())
+        self.totals[name].set(row, list(totals), list(totals.values()))
+
+    def parse_snmp(self, row, text):
+        tcp = [line.split()[1:] for line in text.splitlines() if line.startswith("Tcp:")]
+        values = dict(zip(tcp[0], tcp[1]))
+        self.tcp.set(row, TCP_COUNTERS, [int(values[key]) for key in TCP_COUNTERS])
+
+    def parse_diskstats(self, row, text):
+        counters = np.zeros(len(DISK_COUNTERS), dtype=np.int64)
+        for line in text.splitlines():
+            fields = line.split()
+            if self.devices is not None and fields[2] not in self.devices:
+                continue
+            counters += [int(fields[3]), int(fields[5]), int(fields[7]), int(fields[9])]
+        self.disk.set(row, DISK_COUNTERS, counters)
+
+    # Sample times, without the first one, and the seconds elapsed since the previous sample
+    def intervals(self):
+        times = self.times.values(self.count)[1][:, 0]
+        index = pd.Index((times[1:] * 1000).astype('datetime64[ms]'), name='time')
+        return index, np.diff(times)
+
+    # Rates between samples of counters of names
+    def rates(self, counters, names):
+        _, elapsed = self.intervals()
+        values = counters.values(self.count)[1][:, counters.columns(names)]
+        return np.diff(values, axis=0) / elapsed[:, None]
+
+    def frames(self):
+        """
+        Returns a dict of data frames of the rates between samples, with the columns of
+        the frames sar_parse and mpstat_parse build: cpu, cswch, tcp, irq and disk, and
+        softirq with the rate of each softirq summed over all CPUs
+        """
+        frames = {}
+        frames["cpu"] = self.cpu_frame()
+        frames["cswch"] = self.cswch_frame()
+        frames["tcp"] = self.tcp_frame()
+        frames["irq"] = self.irq_frame()
+        frames["softirq"] = self.counter_frame("softirqs")
+        frames["disk"] = self.disk_frame()
+        return frames
+
+    def cpu_frame(self):
+        index, _ = self.intervals()
+        names = self.cpu_names
+        # Only the samples since the CPUs last changed have the same rows
+        first = self.cpu_since
+        ticks = self.cpu.values(self.count)[1][first:, self.cpu.columns(names)]
+        deltas = np.diff(ticks, axis=0).astype(np.float64)
+        index = index[first:]
+        user, nice, system, idle, iowait, irq, softirq, steal, guest, guest_nice = np.moveaxis(deltas, 2, 0)
+        # Guest time is also counted in user and nice time, sar reports them separately
+        total = user + nice + system + idle + iowait + irq + softirq + steal
+        total[total == 0] = 1
+        columns = {"usr": user - guest, "nice": nice - guest_nice, "sys": system, "iowait": iowait,
+                   "steal": steal, "irq": irq, "soft": softirq, "guest": guest, "gnice": guest_nice,
+                   "idle": idle}
+
+        df = pd.DataFrame({name: (100 * value / total).ravel() for name, value in columns.items()},
+                          index=pd.Index(np.repeat(index, len(names)), name='time'))
+        df.insert(0, "cpu", np.tile(names, len(index)))
+        return df
+
+    def cswch_frame(self):
+        index, _ = self.intervals()
+        rates = self.rates(self.stat, ["processes", "ctxt"])
+        return pd.DataFrame({"proc_s": rates[:, 0], "cswch_s": rates[:, 1]}, index=index)
+
+    def tcp_frame(self):
+        index, _ = self.intervals()
+        rates = self.rates(self.tcp, TCP_COUNTERS)
+        return pd.DataFrame({"active": rates[:, 0], "passive": rates[:, 1],
+                             "iseg": rates[:, 2], "oseg": rates[:, 3]}, index=index)
+
+    def counter_frame(self, name):
+        index, _ = self.intervals()
+        names = list(self.totals[name].names)
+        return pd.DataFrame(self.rates(self.totals[name], names), index=index, columns=names)
+
+    def irq_frame(self):
+        df = self.counter_frame("interrupts")
+        # The first number of the intr line of /proc/stat counts every interrupt
+        df.insert(0, "irq_s", self.rates(self.stat, ["intr"])[:, 0])
+        return df
+
+    def disk_frame(self):
+        index, _ = self.intervals()
+        rates = self.rates(self.disk, DISK_COUNTERS)
+        return pd.DataFrame({"tps": rates[:, 0] + rates[:, 2], "rtps": rates[:, 0], "wtps": rates[:, 2],
+                             "breads": rates[:, 1], "bwrtns": rates[:, 3]}, index=index)
+
+
+# Sample for duration seconds every interval seconds, returns the frames of ProcSampler.frames
+def sample_proc(duration, interval=0.1, root="/"):
+    sampler = ProcSampler(root)
+    try:
+        sampler.run(duration, interval)
+    finally:
+        sampler.close()
+    return sampler.frames()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--time", default=5, type=float, help="How long to sample for in seconds")
+    parser.add_argument("--interval", default=0.1, type=float, help="Seconds between samples")
+    parser.add_argument("--root", default="/", type=str, help="Directory holding the proc tree to read")
+    parser.add_argument("--suffix", type=str, help="Suffix added to the names of the parquet files written")
+    args = parser.parse_args()
+
+    for name, df in sample_proc(args.time, args.interval, args.root).items():
+        if args.suffix:
+            df.to_parquet("proc_{}_{}.parquet".format(name, args.suffix), compression='gzip')
+        else:
+            df.to_parquet("proc_{}.parquet".format(name), compression='gzip')
@@ -0,0 +1,182 @@
+#!/opt/perfrunbook-venv/bin/python3
+
+import math
+from collections import defaultdict
+
+import numpy as np
+
+# A DDSketch (Masson, Rim and Lee, VLDB 2019): a streaming quantile sketch whose
+# estimates are within a relative error of the true quantile.  Values are counted in
+# logarithmic buckets, bucket k holds (gamma^(k-1), gamma^k] with gamma set by the
+# relative accuracy, so the memory it takes grows with the range of the values, not
+# with how many were added.  Sketches of the same accuracy merge exactly, e.g. the
+# sketches of every CPU or host into one.  Next to the buckets the sketch keeps the
+# exact minimum and maximum and the moments of the logs for the geometric mean.
+#
+# The stats scripts share it for the geomean and percentiles they report:
+#   sketch = DDSketch()
+#   sketch.add(df["usr"])
+#   summarize(sketch)  # {"geomean": ..., "p10": ..., "p50": ..., ...}
+
+DEFAULT_RELATIVE_ACCURACY = 0.01
+
+# Percentiles summarize reports by default
+PERCENTILES = {"p10": 10, "p50": 50, "p90": 90, "p99": 99, "p99.9": 99.9}
+
+
+class DDSketch(object):
+
+    def __init__(self, relative_accuracy=DEFAULT_RELATIVE_ACCURACY):
+        self.relative_accuracy = relative_accuracy
+        self.gamma = (1 + relative_accuracy) / (1 - relative_accuracy)
+        self.log_gamma = math.log(self.gamma)
+        # Bucket counts of the positive values and of the magnitude of negative values
+        self.positive = defaultdict(int)
+        self.negative = defaultdict(int)
+        self.zeros = 0
+        self.count = 0
+        self.min = math.inf
+        self.max = -math.inf
+        # Count of values <= 0 and sums of the logs and squared logs of the others
+        self.nonpositive = 0
+        self.log_sum = 0.0
+        self.log_sum_sq = 0.0
+        # Sorted bucket keys and cumulative counts at_rank looks ranks up in, built on
+        # the first lookup after values were added
+        self._cumulative = None
+
+    def _add_buckets(self, store, values):
+        keys, counts = np.unique(np.ceil(np.log(values) / self.log_gamma).astype(np.int64), return_counts=True)
+        for key, count in zip(keys.tolist(), counts.tolist()):
+            store[key] += count
+
+    def add(self, values):
+        """
+        Adds an array of values, values that are not finite are left out
+        """
+        values = np.asarray(values, dtype=np.float64).ravel()
+        values = values[np.isfinite(values)]
+        if not len(values):
+            return
+        self._cumulative = None
+        positive = values[values > 0]
+        negative = values[values < 0]
+        if len(positive):
+            self._add_buckets(self.positive, positive)
+            logs = np.log(positive)
+            self.log_sum += float(logs.sum())
+            self.log_sum_sq += float(np.dot(logs, logs))
+        if len(negative):
+            self._add_buckets(self.negative, -negative)
+        self.zeros += len(values) - len(positive) - len(negative)
+        self.nonpositive += len(values) - len(positive)
+        self.count += len(values)
+        self.min = min(self.min, float(values.min()))
+        self.max = max(self.max, float(values.max()))
+
+    def merge(self, other):
+        """
+        Adds the values of another sketch of the same relative accuracy
+        """
+        if other.relative_accuracy != self.relative_accuracy:
+            raise ValueError("Cannot merge sketches of relative accuracy {} and {}".format(
+                self.relative_accuracy, other.relative_accuracy))
+        self._cumulative = None
+        for key, count in other.positive.items():
+            self.positive[key] += count
+        for key, count in other.negative.items():
+            self.negative[key] += count
+        self.zeros += other.zeros
+        self.count += other.count
+        self.min = min(self.min, other.min)
+        self.max = max(self.max, other.max)
+        self.nonpositive += other.nonpositive
+        self.log_sum += other.log_sum
+        self.log_sum_sq += other.log_sum_sq
+        return self
+
+    def _value(self, key):
+        # Middle of bucket key in relative terms, within relative_accuracy of its values
+        return 2 * self.gamma ** key / (self.gamma + 1)
+
+    def quantile(self, q):
+        """
+        Returns the estimate of quantile q, from 0 to 1, or nan if the sketch is empty.
+        Like scipy.stats.scoreatpercentile it interpolates between the values whose
+        ranks surround the quantile's.
+        """
+        rank = q * (self.count - 1)
+        below = math.floor(rank)
+        value = self.at_rank(below)
+        if rank == below:
+            return value
+        return value + (rank - below) * (self.at_rank(below + 1) - value)
+
+    def at_rank(self, rank):
+        """
+        Returns the estimate of the value of 0 based rank in sorted order, the smallest
+        and largest value are exact
+        """
+        if not self.count:
+            return float("nan")
+        if rank <= 0:
+            return self.min
+        if rank >= self.count - 1:
+            return self.max
+
+        negative_keys, negative_counts, positive_keys, positive_counts = self._cumulative_counts()
+        i = np.searchsorted(negative_counts, rank, side="right")
+        if i < len(negative_keys):
+            return -self._value(negative_keys[i])
+        seen = negative_counts[-1] if len(negative_keys) else 0
+
+        if rank < seen + self.zeros:
+            return 0.0
+
+        i = np.searchsorted(positive_counts, rank, side="right")
+        return self._value(positive_keys[min(i, len(positive_keys) - 1)])
+
+    def _cumulative_counts(self):
+        # Buckets in the order of their values, from the most negative value up, and the
+        # number of values up to and including each, counting the zeros before the positives
+        if self._cumulative is None:
+            negative_keys = sorted(self.negative, reverse=True)
+            negative_counts = np.cumsum([self.negative[key] for key in negative_keys], dtype=np.int64)
+            seen = (negative_counts[-1] if len(negative_keys) else 0) + self.zeros
+            positive_keys = sorted(self.positive)
+            positive_counts = np.cumsum([self.positive[key] for key in positive_keys], dtype=np.int64) + seen
+            self._cumulative = (negative_keys, negative_counts, positive_keys, positive_counts)
+        return self._cumulative
+
+    def geomean(self):
+        """
+        Returns the geometric mean, 0 if a value is 0 and nan with negative values, like
+        scipy.stats.gmean
+        """
+        if not self.count or self.min < 0:
+            return float("nan")
+        if self.nonpositive:
+            return 0.0
+        return math.exp(self.log_sum / self.count)
+
+    def log_std(self):
+        """
+        Returns the sample standard deviation of the logs of the positive values
+        """
+        n = self.count - self.nonpositive
+        if n < 2:
+            return float("nan")
+        return math.sqrt(max(self.log_sum_sq - self.log_sum ** 2 / n, 0.0) / (n - 1))
+
+    def __len__(self):
+        return self.count
+
+
+def summarize(sketch, percentiles=PERCENTILES):
+    """
+    Returns a dict of the geomean and the percentiles of a sketch, by name
+    """
+    data = {"geomean": sketch.geomean()}
+    for name, percentile in percentiles.items():
+        data[name] = sketch.quantile(percentile / 100.0)
+    return data
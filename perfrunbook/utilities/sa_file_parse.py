@@ -0,0 +1,409 @@
+#!/opt/perfrunbook-venv/bin/python3
+
+import argparse
+import struct
+import numpy as np
+import pandas as pd
+
+from sar_parse import ParseCpuTime, ParseCSwitchTime, ParseDiskUtil, ParseIfaceUtil, ParseTcpTime
+
+# Reads the binary data files written by sadc (sar -o out.dat, /var/log/sa/saNN)
+# straight into the same data frames the Parse* classes in sar_parse.py build out of
+# sar's text output, skipping the render-to-text and re-parse round trip.
+#
+# Supports the datafile format used by sysstat 12.x (format magic 0x2175) written on a
+# 64-bit host.  Every structure is checked against the layout the file itself
+# describes, anything else raises UnsupportedFormat so callers can fall back to
+# rendering the file with sar -f.  Values are not rounded to sar's two decimals.
+#
+# The decoder has not been checked against data files captured with every sysstat
+# release yet, see tests/test_sa_file_parse.py, so measure_and_plot_basic_sysstat_stats.py
+# only uses it with --decode-sa.
+
+SYSSTAT_MAGIC = 0xd596
+SYSSTAT_MAGIC_SWAPPED = 0x96d5
+FORMAT_MAGIC = 0x2175
+
+# struct file_magic: magic numbers, sysstat version, header_size, upgraded,
+# hdr_types_nr[3] and 48 bytes of padding
+FILE_MAGIC_FMT = "HHBBBBIIIII48x"
+
+# (unsigned long long, unsigned long, unsigned int) counts of the structures we decode
+FILE_HEADER_TYPES = (1, 1, 12)
+FILE_ACTIVITY_TYPES = (0, 0, 9)
+RECORD_HEADER_TYPES = (2, 0, 1)
+
+UTSNAME_LEN = 65
+MAX_COMMENT_LEN = 64
+MAX_IFACE_LEN = 16
+
+# Record types
+R_STATS = 1
+R_RESTART = 2
+R_COMMENT = 4
+
+# Activity ids
+A_CPU = 1
+A_PCSW = 2
+A_IRQ = 3
+A_IO = 6
+A_NET_DEV = 12
+A_NET_TCP = 21
+
+# Activities whose item count is written again after every RESTART record
+PERSISTENT_ACTIVITIES = (A_IRQ,)
+
+
+class UnsupportedFormat(Exception):
+    pass
+
+
+class SaActivity(object):
+
+    def __init__(self, endian, act_id, nr, nr2, has_nr, size, types_nr):
+        self.id = act_id
+        self.nr = nr
+        self.nr2 = nr2
+        self.has_nr = has_nr
+        self.size = size
+        self.types_nr = tuple(types_nr)
+        # Items of every statistics record, and the index of the record they belong to
+        self.items = []
+        self.records = []
+
+        # sysstat lays out every statistics structure as its unsigned long longs,
+        # then unsigned longs, then unsigned ints, then anything else.
+        ull, ul, u = self.types_nr
+        names = []
+        formats = []
+        offsets = []
+        offset = 0
+        for name, count, fmt, width in (("ull", ull, "u8", 8), ("ul", ul, "u8", 8), ("u", u, "u4", 4)):
+            if count:
+                names.append(name)
+                formats.append((endian + fmt, (count,)))
+                offsets.append(offset)
+            offset += count * width
+        self.chars = offset
+        if offset > size:
+            raise UnsupportedFormat("activity {} has a structure larger than its size".format(act_id))
+        self.dtype = np.dtype({'names': names, 'formats': formats, 'offsets': offsets, 'itemsize': size})
+
+    def values(self, kind):
+        return np.concatenate([items[kind] for items in self.items]).astype(np.int64)
+
+    def chars_at(self, offset, length):
+        # Returns the fixed length string found offset bytes after the numeric fields
+        raw = np.concatenate([items.view(np.uint8).reshape(-1, self.size) for items in self.items])
+        start = self.chars + offset
+        names = np.ascontiguousarray(raw[:, start:start + length]).view("S{}".format(length)).ravel()
+        return np.char.decode(names)
+
+    def record_index(self):
+        return np.concatenate([np.full(len(items), rec) for items, rec in zip(self.items, self.records)])
+
+
+class SaFile(object):
+
+    def __init__(self, data):
+        self.data = data
+        self.parse_headers()
+        self.parse_records()
+
+    def parse_headers(self):
+        data = self.data
+        if len(data) < struct.calcsize(FILE_MAGIC_FMT):
+            raise UnsupportedFormat("file too short to be a sysstat data file")
+
+        magic = struct.unpack_from("<H", data, 0)[0]
+        if magic == SYSSTAT_MAGIC:
+            self.endian = "<"
+        elif magic == SYSSTAT_MAGIC_SWAPPED:
+            self.endian = ">"
+        else:
+            raise UnsupportedFormat("not a sysstat data file")
+
+        fmt = self.endian + FILE_MAGIC_FMT
+        (_, format_magic, version, patchlevel, sublevel, _,
+         header_size, _, hdr_ull, hdr_ul, hdr_u) = struct.unpack_from(fmt, data, 0)
+        self.version = "{}.{}.{}".format(version, patchlevel, sublevel)
+        if format_magic != FORMAT_MAGIC:
+            raise UnsupportedFormat("datafile format {:#x} from sysstat {} is not supported".format(
+                format_magic, self.version))
+        if (hdr_ull, hdr_ul, hdr_u) != FILE_HEADER_TYPES:
+            raise UnsupportedFormat("unexpected file header layout")
+
+        # struct file_header
+        pos = struct.calcsize(fmt)
+        hdr = struct.unpack_from(self.endian + "QQIIi3I3IIII", data, pos)
+        (_, _, self.cpu_nr, act_nr, year) = hdr[:5]
+        act_types = hdr[5:8]
+        rec_types = hdr[8:11]
+        act_size, rec_size, extra_next = hdr[11:14]
+        day, month, sizeof_long = struct.unpack_from("BBb", data, pos + 64)
+        nodename = struct.unpack_from("{}s".format(UTSNAME_LEN), data, pos + 67 + UTSNAME_LEN)[0]
+        self.host = nodename.split(b"\0", 1)[0].decode()
+        self.start_date = "{:04d}-{:02d}-{:02d}".format(year + 1900, month + 1, day)
+
+        if sizeof_long != 8:
+            raise UnsupportedFormat("only data files from 64-bit hosts are supported")
+        if act_types != FILE_ACTIVITY_TYPES or act_size != 36:
+            raise UnsupportedFormat("unexpected activity list layout")
+        if rec_types != RECORD_HEADER_TYPES or rec_size != 24:
+            raise UnsupportedFormat("unexpected record header layout")
+        if extra_next:
+            raise UnsupportedFormat("extra structures in the file header are not supported")
+        pos += header_size
+
+        # struct file_activity list
+        self.activities = []
+        for i in range(act_nr):
+            act_id, _, nr, nr2, has_nr, size, ull, ul, u = struct.unpack_from(self.endian + "IIiiiiIII", data, pos)
+            self.activities.append(SaActivity(self.endian, act_id, nr, nr2, has_nr, size, (ull, ul, u)))
+            pos += act_size
+        self.rec_size = rec_size
+        self.pos = pos
+
+    def parse_records(self):
+        data = self.data
+        pos = self.pos
+        rec_fmt = self.endian + "QQIBBBB"
+        nr_fmt = self.endian + "i"
+        uptime = []
+        times = []
+        segments = []
+        segment = 0
+
+        while pos + self.rec_size <= len(data):
+            uptime_cs, _, extra_next, rtype, hour, minute, second = struct.unpack_from(rec_fmt, data, pos)
+            pos += self.rec_size
+            if extra_next or hour > 23 or minute > 59 or second > 60:
+                raise UnsupportedFormat("unexpected record at offset {}".format(pos - self.rec_size))
+
+            if rtype == R_COMMENT:
+                pos += MAX_COMMENT_LEN
+                continue
+            if rtype == R_RESTART:
+                # New number of CPUs, then the item count of persistent activities
+                pos += 4
+                for act in self.activities:
+                    if act.id in PERSISTENT_ACTIVITIES:
+                        pos += 4
+                # Counters restart from zero, rates are never computed across a restart
+                segment += 1
+                continue
+            if rtype != R_STATS:
+                raise UnsupportedFormat("unknown record type {}".format(rtype))
+
+            rec = len(uptime)
+            for act in self.activities:
+                if act.has_nr:
+                    if pos + 4 > len(data):
+                        pos += 4
+                        break
+                    nr = struct.unpack_from(nr_fmt, data, pos)[0]
+                    pos += 4
+                else:
+                    nr = act.nr
+                count = nr * act.nr2
+                if count and pos + count * act.size <= len(data):
+                    act.items.append(np.frombuffer(data, dtype=act.dtype, count=count, offset=pos))
+                    act.records.append(rec)
+                pos += count * act.size
+
+            if pos > len(data):
+                # Truncated last record, sadc was still writing it
+                for act in self.activities:
+                    if act.records and act.records[-1] == rec:
+                        act.items.pop()
+                        act.records.pop()
+                break
+
+            uptime.append(uptime_cs)
+            times.append(b"%02d:%02d:%02d" % (hour, minute, second))
+            segments.append(segment)
+
+        self.uptime = np.array(uptime, dtype=np.int64)
+        self.times = np.array(times, dtype="S8")
+        self.segments = np.array(segments, dtype=np.int64)
+
+    def get_activity(self, act_id):
+        for act in self.activities:
+            if act.id == act_id and act.items:
+                return act
+        return None
+
+
+# Difference every counter column with the previous record of the same item, never across a
+# restart.  Returns the deltas, the record index of each row and the interval in 1/100s.
+def counter_deltas(sa, act, columns, item):
+    rec = act.record_index()
+    df = pd.DataFrame(columns)
+    keys = [sa.segments[rec], item]
+    prev_rec = pd.Series(rec).groupby(keys).shift(1)
+    deltas = df.groupby(keys).diff()
+
+    keep = prev_rec.notna().to_numpy()
+    rec_prev = prev_rec[keep].to_numpy(dtype=np.int64)
+    rec = rec[keep]
+    itv = (sa.uptime[rec] - sa.uptime[rec_prev]).astype(np.float64)
+    return deltas[keep].reset_index(drop=True), rec, itv, keep
+
+
+def rate(delta, itv):
+    # Per second rate out of a counter delta over an interval in 1/100s
+    return np.where(itv > 0, delta / itv * 100, 0.0)
+
+
+def build_frame(sa, parser, rec, columns):
+    times = parser.parse_times(sa.times)
+    data = {'time': times[rec]}
+    for name, kind in parser.fields[1:]:
+        values = columns[name]
+        if kind is str and np.issubdtype(np.asarray(values).dtype, np.floating):
+            # Match the text parser which keeps these columns as sar printed them
+            values = np.char.mod("%.2f", values)
+        data[name] = values
+    df = pd.DataFrame(data)
+    return df.set_index('time')
+
+
+def cpu_frame(sa, parser):
+    act = sa.get_activity(A_CPU)
+    if act is None or act.types_nr[0] != 10:
+        return None
+
+    # stats_cpu: user, nice, sys, idle, iowait, steal, hardirq, softirq, guest, guest_nice
+    ull = act.values("ull")
+    item = np.concatenate([np.arange(len(items)) for items in act.items])
+    names = ["user", "nice", "sys", "idle", "iowait", "steal", "hardirq", "softirq", "guest", "guest_nice"]
+    deltas, rec, _, keep = counter_deltas(sa, act, {name: ull[:, i] for i, name in enumerate(names)}, item)
+    d = {name: deltas[name].to_numpy(dtype=np.float64).clip(min=0) for name in names}
+
+    # Guest time is already accounted for in user and nice time
+    usr = (d["user"] - d["guest"]).clip(min=0)
+    nice = (d["nice"] - d["guest_nice"]).clip(min=0)
+    total = d["user"] + d["nice"] + d["sys"] + d["idle"] + d["iowait"] + d["steal"] + d["hardirq"] + d["softirq"]
+    tickless = total == 0
+    total = np.where(tickless, 1, total)
+
+    def pct(x):
+        return np.where(tickless, 0.0, x / total * 100)
+
+    columns = {
+        'cpu': np.where(item[keep] == 0, "all", (item[keep] - 1).astype(str)),
+        'usr': pct(usr), 'nice': pct(nice), 'sys': pct(d["sys"]), 'iowait': pct(d["iowait"]),
+        'steal': pct(d["steal"]), 'irq': pct(d["hardirq"]), 'soft': pct(d["softirq"]),
+        'guest': pct(d["guest"]), 'gnice': pct(d["guest_nice"]),
+        'idle': np.where(tickless, 100.0, d["idle"] / total * 100),
+    }
+    return build_frame(sa, parser, rec, columns)
+
+
+def cswitch_frame(sa, parser):
+    act = sa.get_activity(A_PCSW)
+    if act is None or act.types_nr[:2] != (1, 1):
+        return None
+
+    # stats_pcsw: context_switch, processes
+    counters = {'cswch_s': act.values("ull")[:, 0], 'proc_s': act.values("ul")[:, 0]}
+    deltas, rec, itv, _ = counter_deltas(sa, act, counters, np.zeros(len(act.record_index())))
+    columns = {name: rate(deltas[name].to_numpy(dtype=np.float64), itv) for name in counters}
+    return build_frame(sa, parser, rec, columns)
+
+
+def disk_frame(sa, parser):
+    act = sa.get_activity(A_IO)
+    if act is None or act.types_nr[0] not in (5, 7):
+        return None
+
+    # stats_io: dk_drive, dk_drive_rio, dk_drive_wio, dk_drive_rblk, dk_drive_wblk, [discards]
+    ull = act.values("ull")
+    names = ['tps', 'rtps', 'wtps', 'breads', 'bwrtns']
+    counters = {name: ull[:, i] for i, name in enumerate(names)}
+    deltas, rec, itv, _ = counter_deltas(sa, act, counters, np.zeros(len(ull)))
+    columns = {name: rate(deltas[name].to_numpy(dtype=np.float64), itv) for name in names}
+    return build_frame(sa, parser, rec, columns)
+
+
+def iface_frame(sa, parser):
+    act = sa.get_activity(A_NET_DEV)
+    if act is None or act.types_nr != (7, 0, 1):
+        return None
+
+    # stats_net_dev: rx_packets, tx_packets, rx_bytes, tx_bytes, rx_compressed, tx_compressed,
+    # multicast, speed, interface
+    ull = act.values("ull")
+    iface = act.chars_at(0, MAX_IFACE_LEN)
+    names = ['rxpcks', 'txpcks', 'rxkBs', 'txkBs', 'rxcmps', 'txcmps', 'rxmcsts']
+    counters = {name: ull[:, i] for i, name in enumerate(names)}
+    deltas, rec, itv, keep = counter_deltas(sa, act, counters, iface)
+    columns = {name: rate(deltas[name].to_numpy(dtype=np.float64), itv) for name in names}
+    columns['rxkBs'] = columns['rxkBs'] / 1024
+    columns['txkBs'] = columns['txkBs'] / 1024
+    columns['iface'] = iface[keep]
+    return build_frame(sa, parser, rec, columns)
+
+
+def tcp_frame(sa, parser):
+    act = sa.get_activity(A_NET_TCP)
+    if act is None or act.types_nr != (0, 4, 0):
+        return None
+
+    # stats_net_tcp: active_opens, passive_opens, in_segs, out_segs
+    ul = act.values("ul")
+    names = ['active', 'passive', 'iseg', 'oseg']
+    counters = {name: ul[:, i] for i, name in enumerate(names)}
+    deltas, rec, itv, _ = counter_deltas(sa, act, counters, np.zeros(len(ul)))
+    columns = {name: rate(deltas[name].to_numpy(dtype=np.float64), itv) for name in names}
+    return build_frame(sa, parser, rec, columns)
+
+
+# Parse class whose frame we produce, and the function decoding it out of the data file.
+# Per device statistics (ParseDevUtil) are not decoded, their layout changed across 12.x releases.
+ACTIVITY_FRAMES = [
+    (ParseCpuTime, cpu_frame),
+    (ParseCSwitchTime, cswitch_frame),
+    (ParseDiskUtil, disk_frame),
+    (ParseIfaceUtil, iface_frame),
+    (ParseTcpTime, tcp_frame),
+]
+
+
+def parse_sa_file(f, suffix=None, save_parquet=True):
+    """
+    Decode a sadc binary data file, given as a path or a binary file object, into a dict of
+    section name to the same data frames sar_parse.py produces.  Raises UnsupportedFormat
+    if the file cannot be decoded directly.
+    """
+    if isinstance(f, str):
+        with open(f, 'rb') as fd:
+            data = fd.read()
+    else:
+        data = f.read()
+    sa = SaFile(data)
+
+    frames = {}
+    for cls, build in ACTIVITY_FRAMES:
+        parser = cls(sa.start_date, parquet=suffix)
+        df = build(sa, parser)
+        if df is None:
+            continue
+        if save_parquet:
+            parser.make_parquet_dir()
+            df.to_parquet(parser.parquet_name, compression='gzip')
+        frames[parser.name] = df
+    return frames
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("file", type=str, help="sadc binary data file, e.g. out.dat or /var/log/sa/saNN")
+    parser.add_argument("--suffix", type=str, help="Suffix added to the names of the parquet files written")
+    args = parser.parse_args()
+
+    try:
+        parse_sa_file(args.file, suffix=args.suffix)
+    except UnsupportedFormat as e:
+        print("ERR: {}, render it with sar -A -f and use sar_parse.py instead".format(e))
+        exit(1)
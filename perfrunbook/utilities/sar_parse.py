@@ -1,7 +1,12 @@
 #!/opt/perfrunbook-venv/bin/python3
 
+import argparse
+import concurrent.futures
+import glob
+import io
+import json
+import os
 import re
-import sys
 import numpy as np
 import pandas as pd
 
@@ -17,203 +22,476 @@ def parse_start_date(line):
     return start_date
 
 
+def parse_host(line):
+    # Get the hostname sar prints in parentheses on the first line
+    hdr = re.compile(r'''.*?\((?P<host>[^)]+)\)''')
+    match_hdr = hdr.match(line)
+    host = None
+    if match_hdr:
+        host = match_hdr['host']
+
+    return host
+
+
+# Field name for a sar header column no section declared, e.g. rkB/s -> rkB_s
+def field_name(header):
+    return re.sub(r'''[^0-9A-Za-z]+''', '_', header.lstrip('%')).strip('_')
+
+
+# Rows per parquet row group.  Rows are written in time order, so the min/max statistics
+# of every row group cover a short time range that readers can skip, see sar_query.py
+ROW_GROUP_ROWS = 16384
+
+
+# Store identifier columns like cpu, iface and dev as categoricals and metrics as float32
+def compact_frame(df):
+    dtypes = {}
+    for name, dtype in df.dtypes.items():
+        if pd.api.types.is_string_dtype(dtype):
+            dtypes[name] = 'category'
+        elif dtype == np.float64:
+            dtypes[name] = np.float32
+    return df.astype(dtypes)
+
+
 class ParseInterface(object):
 
-    def __init__(self, start_date):
-        self.regex_hdr = None
-        self.regex_data = None
+    # Subclasses declare a section by its name and, for each column of the sar header,
+    # the column name sar prints, the field name it is stored under and its type.
+    name = "sar"
+    columns = []
+    # Header columns other sysstat releases print for a declared column, mapped to the
+    # declared header name or to (declared header name, factor converting to its unit).
+    aliases = {}
+
+    def __init__(self, start_date, parquet=None):
+        headers = [column[0] for column in self.columns]
         self.regex_footer = re.compile(r'''Average:.*''')
+        # First two column names of the section header as this sysstat prints them
+        self.hdr_key = tuple(headers[:2])
+        # Every header column name that maps to a declared column
+        self.known = {column[0]: (column[1], column[2], 1) for column in self.columns}
+        for alias, target in self.aliases.items():
+            target, scale = target if isinstance(target, tuple) else (target, 1)
+            self.known[alias] = self.known[target][:2] + (scale,)
+        self.header = None
+        self.set_layout([(column[1], column[2], 1) for column in self.columns])
         self.start = start_date
         self.last_date = None
-        self.parquet_name = "sar.parquet"
-        self.fields = []
+        if parquet:
+            self.parquet_name = "sar_{}_{}.parquet".format(self.name, parquet)
+        else:
+            self.parquet_name = "sar_{}.parquet".format(self.name)
+        self.found = False
+        self.lines = []
+        # Lines already parsed because a header with a different layout followed them
+        self.frames = []
+        # When set, lines are flushed to the parquet file as a row group every
+        # chunk_rows lines to keep memory bounded, see flush()
+        self.chunk_rows = None
+        self.writer = None
+        # When set, frames are stored with the schema of compact_frame() and the memory
+        # they use before and after is summed up in self.memory, in bytes
+        self.compact = False
+        self.memory = [0, 0]
+
+    # True if a header starting with these two column names belongs to this section
+    def matches_header(self, first, second):
+        return (first in self.known and self.known[first][0] == self.columns[0][1] and
+                second in self.known)
+
+    # Derive the layout of the data lines from the column names of their header.  Declared
+    # columns and their aliases are stored under the declared field names, columns this
+    # section does not declare are kept as extra fields, declared columns this sysstat
+    # release does not print are filled with NaN so the schema stays the same.
+    def set_header(self, header):
+        header = tuple(header)
+        if header == self.header:
+            return
+        if self.lines:
+            self.frames.append(self.parse_lines(self.lines))
+            self.lines = []
+        self.header = header
+
+        layout = []
+        for column in header:
+            if column in self.known:
+                layout.append(self.known[column])
+            elif column.isalpha() and column.isupper():
+                # Identifiers like CPU, IFACE, DEV are upper case, metrics are not
+                layout.append((field_name(column), str, 1))
+            else:
+                layout.append((field_name(column), float, 1))
+        self.set_layout(layout)
+
+    def set_layout(self, layout):
+        self.layout = [('time', None, 1)] + layout
+        declared = [(column[1], column[2]) for column in self.columns]
+        names = set(name for name, kind in declared)
+        self.fields = [('time', None)] + declared + [(key[0], key[1]) for key in layout if key[0] not in names]
+
+    # Pass in an array of byte strings in hh:mm:ss format
+    # Uses self.last_date, an np.datetime64 obj or None, to roll samples over midnight
+    # Returns an array of np.datetime64 objects
+    def parse_times(self, times):
+        if times.dtype.itemsize != 8 and len(times):
+            raise ValueError(f"{self.name} timestamps are not in hh:mm:ss format, e.g. {times[0]!r}")
+        digits = times.view(np.uint8).reshape(-1, 8).astype(np.int64) - ord('0')
+        secs = ((digits[:, 0] * 10 + digits[:, 1]) * 3600 +
+                (digits[:, 3] * 10 + digits[:, 4]) * 60 +
+                (digits[:, 6] * 10 + digits[:, 7]))
+
+        # Every time the clock goes backwards we crossed midnight
+        days = np.zeros(len(secs), dtype=np.int64)
+        days[1:] = np.cumsum(secs[1:] < secs[:-1])
+
+        start = np.datetime64(self.start, 's')
+        if self.last_date is not None:
+            behind = (self.last_date - (start + np.timedelta64(secs[0], 's'))) // np.timedelta64(1, 's')
+            if behind > 0:
+                days += -(-behind // 86400)
+
+        d = start + (secs + days * 86400).astype('timedelta64[s]')
+        self.last_date = d[-1]
+        return d
 
-    # Pass in a dict s:
-    # { date: string in YYYY-MM-DD
-    #   time: string in hh:mm:ss
-    # }
-    # Pass in a last_date as an np.datetime64 obj or None
-    # Returns a np.datetime64 object
-    def parse_time(self, s, last_date):
+    def reset(self):
+        self.lines = []
+        self.frames = []
+
+    # Queue up a single data line of this section for the bulk parse
+    def parse_line(self, line):
+        self.lines.append(line)
+        if self.chunk_rows and len(self.lines) >= self.chunk_rows:
+            self.flush()
+
+    # Split the raw lines into typed columns in one pass
+    def parse_lines(self, lines):
+        names = [key[0] for key in self.fields]
+        if not lines:
+            df = pd.DataFrame({name: [] for name in names})
+            return df.set_index('time')
+
+        columns = [key[0] for key in self.layout]
+        dtypes = {key[0]: key[1] for key in self.layout[1:]}
+        dtypes['time'] = str
+        df = pd.read_csv(io.StringIO("".join(lines)), sep=r'\s+', header=None, names=columns,
+                         usecols=range(len(columns)), dtype=dtypes)
+        for name, kind, scale in self.layout[1:]:
+            if scale != 1:
+                df[name] *= scale
+        df['time'] = self.parse_times(df['time'].to_numpy(dtype=np.bytes_))
+        if columns != names:
+            df = df.reindex(columns=names)
+        return df.set_index('time')
+
+    # Lines parsed so far, including those parsed before a change of layout
+    def parse_pending(self):
+        df = self.parse_lines(self.lines)
+        self.lines = []
+        if self.frames:
+            df = pd.concat(self.frames + [df])
+            self.frames = []
+        if self.compact:
+            self.memory[0] += df.memory_usage(deep=True).sum()
+            df = compact_frame(df)
+            self.memory[1] += df.memory_usage(deep=True).sum()
+        return df
 
-        d = np.datetime64("{} {}".format(s['date'], s['time']))
+    # Output may go to a dataset directory that does not exist yet
+    def make_parquet_dir(self):
+        dir_name = os.path.dirname(self.parquet_name)
+        if dir_name:
+            os.makedirs(dir_name, exist_ok=True)
 
-        if last_date:
-            while (d - last_date) < np.timedelta64(0, 's'):
-                d = d + np.timedelta64(1, 'D')
+    # Build the data frame out of every line parsed so far
+    def get_dataframe(self, save_parquet=True):
+        df = self.parse_pending()
+        if (save_parquet):
+            self.make_parquet_dir()
+            df.to_parquet(self.parquet_name, compression='gzip', row_group_size=ROW_GROUP_ROWS)
+        return df
 
-        return d
+    # Schema of the parquet file a streaming parse writes.  It only holds the declared
+    # columns, so every row group has the same columns whatever headers sar printed, e.g.
+    # after a restart, and categoricals always use a 32 bit dictionary index.
+    def writer_schema(self):
+        import pyarrow as pa
+
+        fields = []
+        for column in self.columns:
+            if column[2] is str:
+                kind = pa.dictionary(pa.int32(), pa.string()) if self.compact else pa.string()
+            else:
+                kind = pa.float32() if self.compact else pa.float64()
+            fields.append(pa.field(column[1], kind))
+        fields.append(pa.field('time', pa.timestamp('s')))
+        # Keep the pandas metadata so readers get time back as the index
+        empty = pd.DataFrame({column[1]: [] for column in self.columns}, index=pd.DatetimeIndex([], name='time'))
+        return pa.schema(fields, metadata=pa.Schema.from_pandas(empty).metadata)
+
+    # Append the lines queued so far to the parquet file as a new row group
+    def flush(self):
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+
+        if not self.lines and not self.frames and self.writer is not None:
+            return
+        if self.writer is None:
+            self.make_parquet_dir()
+            self.writer = pq.ParquetWriter(self.parquet_name, self.writer_schema(), compression='gzip')
+        df = self.parse_pending().reindex(columns=[column[1] for column in self.columns])
+        for column in self.columns:
+            if column[2] is str and not isinstance(df[column[1]].dtype, pd.CategoricalDtype):
+                # Identifiers a header did not print are NaN
+                df[column[1]] = df[column[1]].astype(object)
+        self.writer.write_table(pa.Table.from_pandas(df, schema=self.writer.schema))
+        self.reset()
+
+    # Flush what is left and finalize the parquet file of a streaming parse
+    def close(self):
+        self.flush()
+        self.writer.close()
+        self.writer = None
 
     def parse_data(self, f, save_parquet=True):
+        self.found = True
+        self.reset()
+        dispatcher = SectionDispatcher([self])
+        dispatcher.current = self
         line = f.readline()
-        data = {}
-        for key in self.fields:
-            data[key[0]] = []
-
         while(line):
-            match_data = self.regex_data.match(line)
-            if match_data:
-                s = {'date': self.start,
-                     'time': match_data['time']}
-                d = self.parse_time(s, self.last_date)
-                data['time'].append(d)
-                self.last_date = d
-
-                # Every other field is not special
-                for key in self.fields[1:]:
-                    data[key[0]].append(key[1](match_data[key[0]]))
-
-                line = f.readline()
-                continue
-            match_footer = self.regex_footer.match(line)
-            if match_footer:
+            if self.regex_footer.match(line):
                 break
+            dispatcher.feed(line)
             line = f.readline()
 
-        df = pd.DataFrame(data)
-        df = df.set_index('time')
-        if (save_parquet):
-            df.to_parquet(self.parquet_name, compression='gzip')
-        return df
-
+        return self.get_dataframe(save_parquet)
 
     # Look for the header, if we find it, read until we hit the end of the section
     # Return the data frame if we get one.
     def parse_for_header(self, line, f, save_parquet=True):
-        match = self.regex_hdr.match(line)
-        if match:
+        tokens = line.split()
+        if len(tokens) > 2 and self.matches_header(tokens[1], tokens[2]):
+            self.set_header(tokens[1:])
             return self.parse_data(f, save_parquet)
         return None
 
 
-class ParseIfaceUtil(ParseInterface):
+# Leading characters of a sar data column, header columns never start with these.
+NUMERIC_START = frozenset("0123456789-.")
 
-    def __init__(self, start_date, parquet=None):
-        super().__init__(start_date)
-
-        self.regex_hdr = re.compile(r'''(?P<time>\d+:\d+:\d+)\s+IFACE\s+'''
-                                    r'''rxpck/s\s+txpck/s\s+rxkB/s\s+txkB/s\s+rxcmp/s\s+txcmp/s\s+'''
-                                    r'''rxmcst/s''')
-        self.regex_data = re.compile(r'''(?P<time>\d+:\d+:\d+)\s+(?P<iface>[\d\w]+)\s+'''
-                                     r'''(?P<rxpcks>\d+\.\d+)\s+(?P<txpcks>\d+\.\d+)\s+(?P<rxkBs>\d+\.\d+)\s+'''
-                                     r'''(?P<txkBs>\d+\.\d+)\s+(?P<rxcmps>\d+\.\d+)\s+(?P<txcmps>\d+\.\d+)\s+'''
-                                     r'''(?P<rxmcsts>\d+\.\d+)''')
-        self.fields = [('time', None), ('iface', str), ('rxpcks', float), ('txpcks', float), ('rxkBs', float),
-                       ('txkBs', float), ('rxcmps', float), ('txcmps', float), ('rxmcsts', float)]
 
-        self.start = start_date
-        self.last_date = None
-        if parquet:
-            self.parquet_name = "sar_iface_{}.parquet".format(parquet)
-        else:
-            self.parquet_name = "sar_iface.parquet"
+# class that tokenizes a SAR log in a single pass, handing each data line only to the
+# parser that owns the current section
+class SectionDispatcher(object):
 
+    def __init__(self, parsers):
+        self.parsers = list(parsers)
+        # Parsers by the names their header can start with, several sections share one,
+        # e.g. CPU, and are told apart by the second header column
+        self.by_first = {}
+        for parser in self.parsers:
+            for column in parser.known:
+                if parser.matches_header(column, parser.hdr_key[1]):
+                    self.by_first.setdefault(column, []).append(parser)
+        self.current = None
 
-# class that embodies the state machine for parsing SAR log for device utilization
-class ParseDevUtil(ParseInterface):
+    # The parser owning a header starting with these two column names, or None
+    def lookup(self, first, second):
+        for parser in self.by_first.get(first, ()):
+            if parser.matches_header(first, second):
+                return parser
+        return None
 
-    def __init__(self, start_date, parquet=None):
-        super().__init__(start_date)
-        self.regex_hdr = re.compile(r'''(?P<time>\d+:\d+:\d+)\s+DEV\s+tps\s+'''
-                                    r'''rd_sec/s\s+wr_sec/s\s+avgrq\-sz\s+avgqu\-sz\s+'''
-                                    r'''await\s+svctm\s+%util''')
-        self.regex_data = re.compile(r'''(?P<time>\d+:\d+:\d+)\s+(?P<dev>[\w\d\-]+)\s+(?P<tps>\d+\.\d+)\s+'''
-                                     r'''(?P<rdsecs>\d+\.\d+)\s+(?P<wrsecs>\d+\.\d+)\s+(?P<avgrqsz>\d+\.\d+)\s+'''
-                                     r'''(?P<avgqusz>\d+\.\d+)\s+(?P<await>\d+\.\d+)\s+(?P<svctm>\d+\.\d+)\s+(?P<util>\d+\.\d+)''')
-        self.fields = [('time', None), ('dev', str), ('tps', float), ('rdsecs', float),
-                       ('wrsecs', float), ('avgrqsz', float), ('avgqusz', float), ('await', float),
-                       ('svctm', float), ('util', float)]
-        self.start = start_date
-        self.last_date = None
-        if parquet:
-            self.parquet_name = "sar_dev_{}.parquet".format(parquet)
+    def feed(self, line):
+        tokens = line.split(None, 3)
+        if len(tokens) < 3:
+            # Blank lines separate the intervals of multi-line sections
+            return
+
+        if tokens[0] == "Average:":
+            self.current = None
+            return
+
+        # Headers are looked up once by their leading column names, the layout of the
+        # data lines that follow is derived from the rest of the header columns.
+        parser = self.lookup(tokens[1], tokens[2])
+        if parser is not None:
+            parser.found = True
+            parser.set_header(line.split()[1:])
+            self.current = parser
+            return
+
+        if tokens[1][0] in NUMERIC_START or tokens[2][0] in NUMERIC_START:
+            if self.current is not None:
+                self.current.parse_line(line)
         else:
-            self.parquet_name = "sar_dev.parquet"
+            # Header of a section nobody registered for, or a RESTART marker
+            self.current = None
+
+    def parse(self, f):
+        for line in f:
+            self.feed(line)
+
+    # Returns a dict of section name to data frame for every section found,
+    # streaming parsers have already written their data and are only closed
+    def finish(self, save_parquet=True):
+        frames = {}
+        for parser in self.parsers:
+            if not parser.found:
+                continue
+            if parser.chunk_rows:
+                parser.close()
+            else:
+                frames[parser.name] = parser.get_dataframe(save_parquet)
+        return frames
+
+
+# Every section parse_sysstat extracts from a SAR log, in the order they are registered
+SECTION_PARSERS = []
+
+
+# Class decorator adding a section to the ones found automatically in SAR logs
+def register_section(cls):
+    SECTION_PARSERS.append(cls)
+    return cls
+
+
+# sar -u ALL / -P ALL
+@register_section
+class ParseCpuTime(ParseInterface):
+    name = "cpu"
+    columns = [('CPU', 'cpu', str), ('%usr', 'usr', float), ('%nice', 'nice', float),
+               ('%sys', 'sys', float), ('%iowait', 'iowait', float), ('%steal', 'steal', float),
+               ('%irq', 'irq', float), ('%soft', 'soft', float), ('%guest', 'guest', float),
+               ('%gnice', 'gnice', float), ('%idle', 'idle', float)]
+    # sar -u without ALL
+    aliases = {'%user': '%usr', '%system': '%sys'}
 
 
-# class that embodies the state machine for parsing SAR log for disk reads/writes
+# sar -b
+@register_section
 class ParseDiskUtil(ParseInterface):
+    name = "disk"
+    columns = [('tps', 'tps', float), ('rtps', 'rtps', float), ('wtps', 'wtps', float),
+               ('bread/s', 'breads', float), ('bwrtn/s', 'bwrtns', float)]
 
-    def __init__(self, start_date, parquet=None):
-        super().__init__(start_date)
-        self.regex_hdr = re.compile(r'''(?P<time>\d+:\d+:\d+)\s+tps\s+rtps\s+'''
-                                    r'''wtps\s+bread/s\s+bwrtn/s''')
-        self.regex_data = re.compile(r'''(?P<time>\d+:\d+:\d+)\s+(?P<tps>\d+\.\d+)\s+'''
-                                     r'''(?P<rtps>\d+\.\d+)\s+(?P<wtps>\d+\.\d+)\s+'''
-                                     r'''(?P<breads>\d+\.\d+)\s+(?P<bwrtns>\d+\.\d+)''')
-
-        self.fields = [('time', None), ('tps', float), ('rtps', float),
-                       ('wtps', float), ('breads', float), ('bwrtns', float)]
-        self.start = start_date
-        self.last_date = None
-        if parquet:
-            self.parquet_name = "sar_disk_{}.parquet".format(parquet)
-        else:
-            self.parquet_name = "sar_disk.parquet"
 
+# sar -d
+@register_section
+class ParseDevUtil(ParseInterface):
+    name = "dev"
+    columns = [('DEV', 'dev', str), ('tps', 'tps', float), ('rd_sec/s', 'rdsecs', float),
+               ('wr_sec/s', 'wrsecs', float), ('avgrq-sz', 'avgrqsz', float), ('avgqu-sz', 'avgqusz', float),
+               ('await', 'await', float), ('svctm', 'svctm', float), ('%util', 'util', float)]
+    # sysstat 11.5.7 and later print kB instead of 512 byte sectors and dropped svctm in 12.x
+    aliases = {'rkB/s': ('rd_sec/s', 2), 'wkB/s': ('wr_sec/s', 2), 'areq-sz': ('avgrq-sz', 2),
+               'aqu-sz': 'avgqu-sz'}
 
-# class that embodies the state machine for parsing SAR logs for cpu utilization
-class ParseTcpTime(ParseInterface):
 
-    def __init__(self, start_date, parquet=None):
-        super().__init__(start_date)
-        self.regex_hdr = re.compile(r'''(?P<time>\d+:\d+:\d+)\s+active/s\s+'''
-                                       r'''passive/s\s+iseg/s\s+oseg/s''')
-        self.regex_data = re.compile(r'''(?P<time>\d+:\d+:\d+)\s+(?P<active>\d+\.\d+)\s+'''
-                                       r'''(?P<passive>\d+\.\d+)\s+(?P<iseg>\d+\.\d+)\s+'''
-                                       r'''(?P<oseg>\d+\.\d+)''')
-
-        self.fields = [('time', None), ('active', str), ('passive', float),
-                       ('iseg', float), ('oseg', float)]
-        self.start = start_date
-        self.last_date = None
-        if parquet:
-            self.parquet_name = "sar_tcp_{}.parquet".format(parquet)
-        else:
-            self.parquet_name = "sar_tcp.parquet"
+# sar -n DEV
+@register_section
+class ParseIfaceUtil(ParseInterface):
+    name = "iface"
+    columns = [('IFACE', 'iface', str), ('rxpck/s', 'rxpcks', float), ('txpck/s', 'txpcks', float),
+               ('rxkB/s', 'rxkBs', float), ('txkB/s', 'txkBs', float), ('rxcmp/s', 'rxcmps', float),
+               ('txcmp/s', 'txcmps', float), ('rxmcst/s', 'rxmcsts', float)]
 
-# class that embodies the state machine for parsing SAR logs for cpu utilization
-class ParseCpuTime(ParseInterface):
 
-    def __init__(self, start_date, parquet=None):
-        super().__init__(start_date)
-        self.regex_hdr = re.compile(r'''(?P<time>\d+:\d+:\d+)\s+CPU\s+'''
-                                       r'''%usr\s+%nice\s+%sys\s+%iowait\s+%steal\s+%irq\s+%soft\s+%guest\s+%gnice\s+%idle''')
-        self.regex_data = re.compile(r'''(?P<time>\d+:\d+:\d+)\s+(?P<cpu>[\d\w]+)\s+'''
-                                       r'''(?P<usr>\d+\.\d+)\s+(?P<nice>\d+\.\d+)\s+(?P<sys>\d+'''
-                                       r'''\.\d+)\s+(?P<iowait>\d+\.\d+)\s+(?P<steal>\d+\.\d+)'''
-                                       r'''\s+(?P<irq>\d+\.\d+)\s+(?P<soft>\d+\.\d+)\s+'''
-                                       r'''(?P<guest>\d+\.\d+)\s+(?P<gnice>\d+\.\d+)\s+(?P<idle>\d+\.\d+)''')
-
-        self.fields = [('time', None), ('cpu', str), ('usr', float),
-                       ('nice', float), ('sys', float), ('iowait', float),
-                       ('steal', float), ('irq', float), ('soft', float),
-                       ('guest', float), ('gnice', float), ('idle', float)]
-        self.start = start_date
-        self.last_date = None
-        if parquet:
-            self.parquet_name = "sar_cpu_{}.parquet".format(parquet)
-        else:
-            self.parquet_name = "sar_cpu.parquet"
+# sar -n TCP
+@register_section
+class ParseTcpTime(ParseInterface):
+    name = "tcp"
+    columns = [('active/s', 'active', str), ('passive/s', 'passive', float),
+               ('iseg/s', 'iseg', float), ('oseg/s', 'oseg', float)]
 
 
+# sar -w
+@register_section
 class ParseCSwitchTime(ParseInterface):
+    name = "cswch"
+    columns = [('proc/s', 'proc_s', float), ('cswch/s', 'cswch_s', float)]
 
-    def __init__(self, start_date, parquet=None):
-        super().__init__(start_date)
-        self.regex_hdr = re.compile(r'''(?P<time>\d+:\d+:\d+)\s+proc/s\s+cswch/s''')
-        self.regex_data = re.compile(r'''(?P<time>\d+:\d+:\d+)\s+(?P<proc_s>\d+\.\d+)\s+(?P<cswch_s>\d+\.\d+)''')
-        self.start = start_date
 
-        self.fields = [('time', None), ('proc_s', float), ('cswch_s', float)]
-        self.last_date = None
-        if parquet:
-            self.parquet_name = "sar_cswch_{}.parquet".format(parquet)
-        else:
-            self.parquet_name = "sar_cswch.parquet"
+# sar -r
+@register_section
+class ParseMemUtil(ParseInterface):
+    name = "mem"
+    columns = [('kbmemfree', 'kbmemfree', float), ('kbavail', 'kbavail', float),
+               ('kbmemused', 'kbmemused', float), ('%memused', 'memused', float),
+               ('kbbuffers', 'kbbuffers', float), ('kbcached', 'kbcached', float),
+               ('kbcommit', 'kbcommit', float), ('%commit', 'commit', float),
+               ('kbactive', 'kbactive', float), ('kbinact', 'kbinact', float), ('kbdirty', 'kbdirty', float)]
+
+
+# sar -B
+@register_section
+class ParsePaging(ParseInterface):
+    name = "paging"
+    columns = [('pgpgin/s', 'pgpgin_s', float), ('pgpgout/s', 'pgpgout_s', float),
+               ('fault/s', 'fault_s', float), ('majflt/s', 'majflt_s', float),
+               ('pgfree/s', 'pgfree_s', float), ('pgscank/s', 'pgscank_s', float),
+               ('pgscand/s', 'pgscand_s', float), ('pgsteal/s', 'pgsteal_s', float), ('%vmeff', 'vmeff', float)]
+
 
+# sar -W
+@register_section
+class ParseSwapping(ParseInterface):
+    name = "swap"
+    columns = [('pswpin/s', 'pswpin_s', float), ('pswpout/s', 'pswpout_s', float)]
 
-def parse_sysstat(file_name, suffix=None):
+
+# sar -n SOFT
+@register_section
+class ParseSoftnet(ParseInterface):
+    name = "softnet"
+    columns = [('CPU', 'cpu', str), ('total/s', 'total_s', float), ('dropd/s', 'dropd_s', float),
+               ('squeezd/s', 'squeezd_s', float), ('rx_rps/s', 'rx_rps_s', float),
+               ('flw_lim/s', 'flw_lim_s', float)]
+
+
+# sar -q
+@register_section
+class ParseLoad(ParseInterface):
+    name = "load"
+    columns = [('runq-sz', 'runq_sz', float), ('plist-sz', 'plist_sz', float),
+               ('ldavg-1', 'ldavg_1', float), ('ldavg-5', 'ldavg_5', float),
+               ('ldavg-15', 'ldavg_15', float), ('blocked', 'blocked', float)]
+
+
+# sar -m CPU
+@register_section
+class ParseCpuFreq(ParseInterface):
+    name = "cpufreq"
+    columns = [('CPU', 'cpu', str), ('MHz', 'mhz', float)]
+
+
+# CPU utilization per NUMA node
+@register_section
+class ParseNodeTime(ParseInterface):
+    name = "node"
+    columns = [('NODE', 'node', str), ('%usr', 'usr', float), ('%nice', 'nice', float),
+               ('%sys', 'sys', float), ('%iowait', 'iowait', float), ('%steal', 'steal', float),
+               ('%irq', 'irq', float), ('%soft', 'soft', float), ('%guest', 'guest', float),
+               ('%gnice', 'gnice', float), ('%idle', 'idle', float)]
+
+
+# Hive style path of one section of one sar file in a dataset keyed by host, date and section
+def dataset_path(dataset, host, date, section, file_name):
+    path = os.path.join(dataset, "host={}".format(host), "date={}".format(date), "section={}".format(section))
+    return os.path.join(path, "{}.parquet".format(os.path.basename(file_name)))
+
+
+# Print the memory the compact schema saved for each section parsed
+def report_compact(parsers):
+    for parser in parsers:
+        if parser.found:
+            before, after = parser.memory
+            print("{}: {:.1f} MB -> {:.1f} MB".format(parser.parquet_name, before / 2**20, after / 2**20))
+
+
+def parse_sysstat(file_name, suffix=None, chunk_rows=None, dataset=None, compact=False):
     with open(file_name, 'r') as f:
 
         # Get start date
@@ -223,24 +501,165 @@ def parse_sysstat(file_name, suffix=None):
             print("ERR: header not first line of Sar file, exiting")
             return 1
 
-        # Initialize parsers
-        parseCPU = ParseCpuTime(start_date, parquet=suffix)
-        parseDisk = ParseDiskUtil(start_date, parquet=suffix)
-        parseDev = ParseDevUtil(start_date, parquet=suffix)
-        parseIface = ParseIfaceUtil(start_date, parquet=suffix)
-        parseTcpTime = ParseTcpTime(start_date, parquet=suffix)
-        parseCswitch = ParseCSwitchTime(start_date, parquet=suffix)
+        # Initialize parsers and walk the file once
+        parsers = [cls(start_date, parquet=suffix) for cls in SECTION_PARSERS]
+        for parser in parsers:
+            parser.chunk_rows = chunk_rows
+            parser.compact = compact
+            if dataset:
+                parser.parquet_name = dataset_path(dataset, parse_host(line), start_date, parser.name, file_name)
+        dispatcher = SectionDispatcher(parsers)
+        dispatcher.parse(f)
+        dispatcher.finish()
+    if compact:
+        report_compact(parsers)
+    return 0
 
-        line = f.readline()
-        while (line):
-            parseCPU.parse_for_header(line, f)
-            parseDisk.parse_for_header(line, f)
-            parseDev.parse_for_header(line, f)
-            parseIface.parse_for_header(line, f)
-            parseTcpTime.parse_for_header(line, f)
-            parseCswitch.parse_for_header(line, f)
+
+# Parse only what was appended to a growing SAR log since the last run.  The byte offset
+# reached, the section being parsed with its header and each parser's last_date are kept in a JSON
+# checkpoint, new records of every section are written as a new part of a parquet
+# dataset directory named like the file parse_sysstat writes.
+def parse_sysstat_incremental(file_name, checkpoint=None, suffix=None, chunk_rows=None, compact=False):
+    checkpoint = checkpoint or "{}.checkpoint.json".format(file_name)
+    state = None
+    if os.path.exists(checkpoint):
+        with open(checkpoint, 'r') as f:
+            state = json.load(f)
+        # A file smaller than what we already parsed was rotated, start over
+        if os.path.getsize(file_name) < state['offset']:
+            state = None
+
+    # Parts written from a file this run starts over on are stale
+    starting_over = not state
+    with open(file_name, 'rb') as f:
+        if state:
+            f.seek(state['offset'])
+        else:
             line = f.readline()
+            start_date = parse_start_date(line.decode())
+            if not start_date:
+                print("ERR: header not first line of Sar file, exiting")
+                return 1
+            state = {'offset': f.tell(), 'start_date': start_date, 'section': None, 'last_date': {}}
+
+        parsers = [cls(state['start_date'], parquet=suffix) for cls in SECTION_PARSERS]
+        dispatcher = SectionDispatcher(parsers)
+        part = "part-{}-{:012d}.parquet".format(state['start_date'], state['offset'])
+        for parser in parsers:
+            if os.path.isfile(parser.parquet_name):
+                raise FileExistsError("{} was written by a parse without --checkpoint, move it away or use "
+                                      "another --suffix to parse incrementally".format(parser.parquet_name))
+            if starting_over:
+                for old_part in glob.glob(os.path.join(parser.parquet_name, "part-*.parquet")):
+                    os.remove(old_part)
+            parser.chunk_rows = chunk_rows
+            parser.compact = compact
+            parser.parquet_name = os.path.join(parser.parquet_name, part)
+            if parser.name in state['last_date']:
+                parser.last_date = np.datetime64(state['last_date'][parser.name])
+            if parser.name == state['section']:
+                dispatcher.current = parser
+                if state.get('header'):
+                    parser.set_header(state['header'])
+
+        offset = state['offset']
+        for line in f:
+            # Leave a line sar is still writing for the next run
+            if not line.endswith(b"\n"):
+                break
+            dispatcher.feed(line.decode())
+            offset += len(line)
+
+        # Only write a part for the sections that got new records
+        for parser in parsers:
+            parser.found = bool(parser.lines) or parser.writer is not None
+        dispatcher.finish()
+        if compact:
+            report_compact(parsers)
+
+    state['offset'] = offset
+    state['section'] = dispatcher.current.name if dispatcher.current else None
+    state['header'] = list(dispatcher.current.header or []) if dispatcher.current else None
+    for parser in parsers:
+        if parser.last_date is not None:
+            state['last_date'][parser.name] = str(parser.last_date)
+    with open(checkpoint + ".tmp", 'w') as f:
+        json.dump(state, f)
+    os.replace(checkpoint + ".tmp", checkpoint)
     return 0
 
+
+# True for a sar text file, False for binary files like the saNN data files sadc writes
+# next to the sarNN text in /var/log/sa
+def is_sar_text(file_name):
+    with open(file_name, 'rb') as f:
+        return b"\0" not in f.read(4096)
+
+
+# Expand directories and glob patterns into the list of sar text files to parse
+def find_sar_files(paths):
+    files = []
+    for path in paths:
+        if os.path.isdir(path):
+            files.extend(sorted(os.path.join(path, name) for name in os.listdir(path)
+                                if os.path.isfile(os.path.join(path, name)) and
+                                is_sar_text(os.path.join(path, name))))
+        elif glob.has_magic(path):
+            files.extend(sorted(name for name in glob.glob(path) if os.path.isfile(name) and is_sar_text(name)))
+        else:
+            files.append(path)
+    return files
+
+
+# Parse sar files from many hosts in a process pool into a single hive partitioned
+# parquet dataset.  Returns a dict of file name to error for the files that failed.
+def parse_sysstat_batch(paths, dataset, jobs=None, chunk_rows=None, compact=False):
+    errors = {}
+    with concurrent.futures.ProcessPoolExecutor(max_workers=jobs) as pool:
+        futures = {}
+        for file_name in find_sar_files(paths):
+            futures[pool.submit(parse_sysstat, file_name, chunk_rows=chunk_rows, dataset=dataset,
+                                compact=compact)] = file_name
+
+        for future in concurrent.futures.as_completed(futures):
+            file_name = futures[future]
+            try:
+                if future.result() != 0:
+                    errors[file_name] = "header not first line of Sar file"
+            except Exception as e:
+                errors[file_name] = "{}: {}".format(type(e).__name__, e)
+    return errors
+
+
 if __name__ == "__main__":
-    exit(parse_sysstat(sys.argv[1]))
+    parser = argparse.ArgumentParser()
+    parser.add_argument("files", type=str, nargs="+",
+                        help="SAR text output to parse, e.g. from sar -A -f out.dat. "
+                             "With --dataset, directories and glob patterns are accepted too")
+    parser.add_argument("--suffix", type=str, help="Suffix added to the names of the parquet files written")
+    parser.add_argument("--chunk-rows", type=int,
+                        help="Stream each section to parquet in row groups of this many rows to bound memory use")
+    parser.add_argument("--dataset", type=str,
+                        help="Parse all files in parallel into a parquet dataset partitioned by host, date and section")
+    parser.add_argument("--jobs", type=int, help="Number of parallel processes used with --dataset, defaults to all CPUs")
+    parser.add_argument("--checkpoint", type=str,
+                        help="Only parse what was appended to the file since the run that wrote this checkpoint")
+    parser.add_argument("--compact", action="store_true",
+                        help="Store CPU, device and interface names as categoricals and metrics as float32, "
+                             "printing the memory saved")
+    args = parser.parse_args()
+
+    if args.dataset:
+        errors = parse_sysstat_batch(args.files, args.dataset, jobs=args.jobs, chunk_rows=args.chunk_rows,
+                                     compact=args.compact)
+        for file_name, error in sorted(errors.items()):
+            print("ERR: {}: {}".format(file_name, error))
+        exit(1 if errors else 0)
+
+    if len(args.files) > 1:
+        parser.error("parsing more than one file needs --dataset")
+    if args.checkpoint:
+        exit(parse_sysstat_incremental(args.files[0], checkpoint=args.checkpoint, suffix=args.suffix,
+                                       chunk_rows=args.chunk_rows, compact=args.compact))
+    exit(parse_sysstat(args.files[0], suffix=args.suffix, chunk_rows=args.chunk_rows, compact=args.compact))
@@ -0,0 +1,91 @@
+#!/opt/perfrunbook-venv/bin/python3
+
+import argparse
+import glob
+import os
+import pandas as pd
+import pyarrow.dataset as ds
+
+from sar_parse import ROW_GROUP_ROWS
+
+# Loads only the rows of a time window, and optionally of some hosts, CPUs, devices or
+# interfaces, out of the parquet files sar_parse.py writes.  The filters are pushed down
+# to pyarrow: row groups whose time statistics fall outside the window are never read
+# and partitions of other hosts in a --dataset directory are never opened.
+
+
+# Open a sar_<section>.parquet file, a directory of incremental parts, or a dataset
+# directory written with --dataset, in which case section selects the sar section
+def open_sar(path, section=None):
+    if not glob.glob(os.path.join(path, "host=*")):
+        return ds.dataset(path, format='parquet', partitioning='hive')
+    if not section:
+        raise ValueError("{} holds every sar section, pick one with section".format(path))
+    # Sections have different columns, only open the files of the one asked for
+    files = glob.glob(os.path.join(path, "host=*", "date=*", "section={}".format(section), "*.parquet"))
+    return ds.dataset(files, format='parquet', partitioning='hive', partition_base_dir=path)
+
+
+# Returns the data frame of the rows between start (inclusive) and end (exclusive).
+# start and end are anything pd.Timestamp accepts, e.g. "2024-03-01 14:02".  Every
+# other keyword selects values of a column, e.g. cpu="all" or dev=["nvme0n1", "nvme1n1"].
+def query_sar(path, start=None, end=None, section=None, hosts=None, **match):
+    dataset = open_sar(path, section)
+
+    filters = []
+    if start is not None:
+        filters.append(ds.field('time') >= pd.Timestamp(start))
+    if end is not None:
+        filters.append(ds.field('time') < pd.Timestamp(end))
+    if hosts is not None:
+        match['host'] = hosts
+    for column, values in match.items():
+        if column not in dataset.schema.names:
+            raise ValueError("{} has no column {}".format(path, column))
+        if isinstance(values, str):
+            values = [values]
+        filters.append(ds.field(column).isin([str(value) for value in values]))
+
+    expr = None
+    for f in filters:
+        expr = f if expr is None else expr & f
+    df = dataset.to_table(filter=expr).to_pandas()
+    if 'time' in df.columns:
+        df = df.set_index('time')
+    return df
+
+
+# Rewrite a parquet file sorted by time, and by the identifier columns within one
+# sample, in row groups of row_group_rows so queries on it can skip row groups.
+# Files sar_parse.py writes already are, this is for files written by other tools.
+def sort_sar(path, out=None, row_group_rows=ROW_GROUP_ROWS):
+    df = pd.read_parquet(path)
+    keys = [name for name in df.columns if not pd.api.types.is_numeric_dtype(df[name])]
+    df = df.reset_index().sort_values(['time'] + keys, kind='stable').set_index('time')
+    df.to_parquet(out or path, compression='gzip', row_group_size=row_group_rows)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("path", type=str,
+                        help="sar_<section>.parquet written by sar_parse.py, or a --dataset directory")
+    parser.add_argument("--section", type=str, help="Section to read from a --dataset directory, e.g. cpu")
+    parser.add_argument("--start", type=str, help="First time to include, e.g. '2024-03-01 14:02'")
+    parser.add_argument("--end", type=str, help="Time to stop at, excluded")
+    parser.add_argument("--host", type=str, action="append", help="Only rows of this host, may be repeated")
+    parser.add_argument("--match", type=str, action="append", default=[],
+                        help="column=value to select, e.g. cpu=all or dev=nvme0n1, may be repeated")
+    parser.add_argument("--sort", action="store_true",
+                        help="Rewrite the file sorted by time in row groups that queries can skip")
+    args = parser.parse_args()
+
+    if args.sort:
+        sort_sar(args.path)
+        exit(0)
+
+    match = {}
+    for item in args.match:
+        column, _, value = item.partition("=")
+        match.setdefault(column, []).append(value)
+    df = query_sar(args.path, start=args.start, end=args.end, section=args.section, hosts=args.host, **match)
+    print(df.to_string())
@@ -0,0 +1,50 @@
+#!/usr/bin/env python3
+"""
+Checks the outlier test of the per CPU breakdown against noise and a hot CPU
+"""
+
+import sys
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, str(Path(__file__).parent.parent.resolve()))
+from measure_aggregated_pmu_stats import StatSketches, calculate_breakdown
+from quantile_sketch import DDSketch
+
+NCPU = 8
+TOPOLOGY = pd.DataFrame({"node": [cpu // 4 for cpu in range(NCPU)], "socket": [0] * NCPU},
+                        index=pd.Index(range(NCPU), name="CPU"))
+
+
+def cpu_sketches(samples, hot_cpu=None, seed=0):
+    """
+    StatSketches with per CPU sketches of lognormal samples of a stat, 3 times higher on hot_cpu
+    """
+    rng = np.random.default_rng(seed)
+    sketches = StatSketches([], per_cpu=True)
+    for cpu in range(NCPU):
+        values = rng.lognormal(0, 0.5, samples)
+        if cpu == hot_cpu:
+            values *= 3
+        sketches.cpu_sketches["stall_frontend_pkc"][cpu] = DDSketch(sketches.relative_accuracy)
+        sketches.cpu_sketches["stall_frontend_pkc"][cpu].add(values)
+    return sketches
+
+
+def test_noise_is_not_flagged():
+    for seed in range(50):
+        tables = calculate_breakdown(cpu_sketches(40, seed=seed), TOPOLOGY)
+        for level, df in tables.items():
+            assert not df["outlier"].any(), (seed, level)
+
+
+def test_hot_cpu_is_flagged():
+    df = calculate_breakdown(cpu_sketches(40, hot_cpu=3), TOPOLOGY)["cpu"]
+    assert df["outlier"].tolist() == [cpu == 3 for cpu in range(NCPU)]
+
+
+def test_few_samples_are_not_scored():
+    df = calculate_breakdown(cpu_sketches(10, hot_cpu=3), TOPOLOGY)["cpu"]
+    assert not df["outlier"].any()
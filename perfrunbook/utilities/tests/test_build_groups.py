@@ -0,0 +1,60 @@
+#!/usr/bin/env python3
+"""
+Checks that the counter groups build_groups packs for the Intel platforms fit the PMU
+"""
+
+import sys
+from pathlib import Path
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).parent.parent.resolve()))
+import measure_aggregated_pmu_stats
+from measure_aggregated_pmu_stats import build_groups, filter_proc
+
+INTEL_PLATFORMS = {
+    "SKX": "Intel(R) Xeon(R) Platinum 8124M CPU @ 3.00GHz",
+    "ICX": "Intel(R) Xeon(R) Platinum 8375C CPU @ 2.90GHz",
+    "SPR": "Intel(R) Xeon(R) Platinum 8488C",
+}
+
+
+@pytest.mark.parametrize("name", INTEL_PLATFORMS)
+def test_groups_fit_the_pmu(name):
+    platforms = filter_proc[INTEL_PLATFORMS[name]]
+    max_ctrs = min(platform.get_max_ctrs() for platform in platforms)
+    fixed_ctrs = {ctr for platform in platforms for ctr in platform.get_fixed_ctrs()}
+
+    for pmu, counter_sets in build_groups(platforms).items():
+        for counter_set in counter_sets:
+            events = sum(ctr.get_num_events() for ctr in counter_set)
+            assert events <= max_ctrs + len(fixed_ctrs), sorted(ctr.get_canonical_name() for ctr in counter_set)
+
+            # Each fixed counter takes one event, the others need general purpose counters
+            fixed_used = {ctr.program_str for ctr in counter_set if ctr.program_str in fixed_ctrs}
+            assert events - len(fixed_used) <= max_ctrs, sorted(ctr.get_canonical_name() for ctr in counter_set)
+
+
+@pytest.mark.parametrize("name", INTEL_PLATFORMS)
+def test_ratios_share_a_group(name):
+    platforms = filter_proc[INTEL_PLATFORMS[name]]
+    counter_groups = build_groups(platforms)
+
+    for platform in platforms:
+        for counter in platform.get_counters():
+            needed = {ctr for ctr in (counter.get_numerator(), counter.get_denominator()) if ctr is not None}
+            assert any(needed <= counter_set for counter_set in counter_groups[counter.get_pmu()]), counter.get_name()
+
+
+@pytest.mark.parametrize("name", INTEL_PLATFORMS)
+def test_cycles_take_a_counter_under_the_nmi_watchdog(name, monkeypatch):
+    monkeypatch.setattr(measure_aggregated_pmu_stats, "nmi_watchdog_enabled", lambda: True)
+    platforms = filter_proc[INTEL_PLATFORMS[name]]
+    max_ctrs = min(platform.get_max_ctrs() for platform in platforms)
+
+    for pmu, counter_sets in build_groups(platforms).items():
+        for counter_set in counter_sets:
+            # Only the instructions retired counter is left fixed
+            events = sum(ctr.get_num_events() for ctr in counter_set
+                         if ctr.program_str != "event=0xc0,umask=0x0")
+            assert events <= max_ctrs, sorted(ctr.get_canonical_name() for ctr in counter_set)
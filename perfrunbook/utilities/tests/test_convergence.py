@@ -0,0 +1,55 @@
+#!/usr/bin/env python3
+"""
+Checks that ConvergenceMonitor judges convergence on windows, not on the CPUs of a window
+"""
+
+import sys
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, str(Path(__file__).parent.parent.resolve()))
+from measure_aggregated_pmu_stats import ConvergenceMonitor, build_groups, filter_proc
+
+PLATFORMS = filter_proc["Intel(R) Xeon(R) Platinum 8375C CPU @ 2.90GHz"]
+NCPU = 64
+
+
+def rotate(monitor, rotations, window_noise, cpu_noise, seed=0):
+    """
+    Feeds the monitor rotations of every group measured on NCPU CPUs, counts shared by
+    the CPUs of a window vary by window_noise and those of each CPU by cpu_noise.
+    Returns the rotations measured before the monitor converged.
+    """
+    rng = np.random.default_rng(seed)
+    groups = build_groups(PLATFORMS)
+    names = sorted({ctr.get_canonical_name() for sets in groups.values() for ctrs in sets for ctr in ctrs})
+    time = 0
+    for rotation in range(rotations):
+        for counter_sets in groups.values():
+            for group, ctrs in enumerate(counter_sets):
+                time += 5
+                window = rng.lognormal(0, window_noise)
+                rows = [(time, cpu, group, ctr.get_canonical_name(), 1e6 * window * rng.lognormal(0, cpu_noise), 100.0)
+                        for cpu in range(NCPU) for ctr in ctrs]
+                df = pd.DataFrame(rows, columns=["time", "CPU", "group", "counter", "count", "frac"])
+                df["counter"] = pd.Categorical(df["counter"], names)
+                monitor.update(df)
+        if monitor.converged:
+            return rotation + 1
+    return rotations
+
+
+def test_waits_for_min_windows():
+    monitor = ConvergenceMonitor(PLATFORMS, 0.05, min_windows=10)
+    assert rotate(monitor, 20, window_noise=0.001, cpu_noise=0.001) == 10
+    assert monitor.converged
+
+
+def test_cpus_of_a_window_are_not_independent():
+    # Plenty of CPUs for a tight interval if they were independent samples, but every
+    # CPU of a window moves together
+    monitor = ConvergenceMonitor(PLATFORMS, 0.05, min_windows=2)
+    rotate(monitor, 10, window_noise=0.5, cpu_noise=0.001)
+    assert not monitor.converged
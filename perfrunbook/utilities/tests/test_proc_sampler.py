@@ -0,0 +1,94 @@
+#!/usr/bin/env python3
+"""
+Checks the rates proc_sampler.py computes out of saved copies of the /proc files.
+
+tests/fixtures/proc/N holds snapshot N of a 2 CPU Graviton host half a second after
+snapshot N-1.  CPU 1 goes offline between snapshots 1 and 2, and IRQ 36 first shows up
+in snapshot 1.
+"""
+
+import shutil
+import sys
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, str(Path(__file__).parent.parent.resolve()))
+import proc_sampler
+
+FIXTURES = Path(__file__).parent / "fixtures" / "proc"
+INTERVAL = 0.5
+
+
+def sample_snapshots(tmp_path, monkeypatch, snapshots):
+    """
+    Samples each snapshot in turn, rewriting the files the sampler keeps open in place
+    """
+    root = tmp_path / "root"
+    shutil.copytree(FIXTURES / str(snapshots[0]), root)
+    for device in ["nvme0n1", "loop0"]:
+        (root / "sys" / "block" / device).mkdir(parents=True)
+
+    times = iter(100 + INTERVAL * np.arange(len(snapshots)))
+    monkeypatch.setattr(proc_sampler.time, "time", lambda: float(next(times)))
+    sampler = proc_sampler.ProcSampler(str(root))
+    for snapshot in snapshots:
+        for path in proc_sampler.PROC_FILES.values():
+            (root / path).write_bytes((FIXTURES / str(snapshot) / path).read_bytes())
+        sampler.sample()
+    sampler.close()
+    return sampler.frames()
+
+
+def test_rates_match_the_counter_deltas(tmp_path, monkeypatch):
+    frames = sample_snapshots(tmp_path, monkeypatch, [0, 1])
+
+    # Per CPU: user +30 of which guest +10, system +10, idle +50, iowait +5, irq +2, softirq +3
+    cpu = frames["cpu"]
+    assert cpu["cpu"].tolist() == ["all", "0", "1"]
+    expected = {"usr": 20, "nice": 0, "sys": 10, "iowait": 5, "steal": 0, "irq": 2, "soft": 3,
+                "guest": 10, "gnice": 0, "idle": 50}
+    for column, value in expected.items():
+        np.testing.assert_allclose(cpu[column], value, err_msg=column)
+
+    cswch = frames["cswch"].iloc[0]
+    assert (cswch["proc_s"], cswch["cswch_s"]) == (20, 1000)
+
+    tcp = frames["tcp"].iloc[0]
+    assert (tcp["active"], tcp["passive"], tcp["iseg"], tcp["oseg"]) == (20, 100, 2000, 1000)
+
+    # IRQ 36 is new, its count so far happened within the interval
+    irq = frames["irq"].iloc[0]
+    assert irq["irq_s"] == 800
+    assert irq[["11", "14", "35", "36", "IPI0", "IPI1", "Err"]].tolist() == [400, 0, 60, 40, 200, 10, 0]
+
+    softirq = frames["softirq"].iloc[0]
+    assert softirq[["TIMER", "NET_RX", "BLOCK", "SCHED", "RCU", "HI"]].tolist() == [400, 200, 40, 140, 40, 0]
+
+    # Whole devices nvme0n1 and loop0 only, nvme0n1p1 is a partition
+    disk = frames["disk"].iloc[0]
+    assert disk[["tps", "rtps", "wtps", "breads", "bwrtns"]].tolist() == [620, 220, 400, 16160, 32000]
+
+    for df in frames.values():
+        assert df.index.name == "time"
+        assert df.index.unique().tolist() == [pd.Timestamp(100 + INTERVAL, unit="s")]
+
+
+def test_cpu_going_offline(tmp_path, monkeypatch):
+    frames = sample_snapshots(tmp_path, monkeypatch, [0, 1, 2, 3])
+
+    # The CPU rates only cover the samples since CPU 1 went offline
+    cpu = frames["cpu"]
+    assert cpu["cpu"].tolist() == ["all", "0"]
+    assert cpu.index.unique().tolist() == [pd.Timestamp(100 + 3 * INTERVAL, unit="s")]
+    expected = {"usr": 40, "sys": 10, "iowait": 10, "idle": 40, "guest": 0}
+    for column, value in expected.items():
+        np.testing.assert_allclose(cpu[column], value, err_msg=column)
+
+    # The other counters keep every interval
+    assert len(frames["cswch"]) == 3
+    np.testing.assert_allclose(frames["cswch"]["cswch_s"], [1000, 500, 500])
+    np.testing.assert_allclose(frames["irq"]["irq_s"], [800, 400, 400])
+    assert frames["irq"]["36"].iloc[-1] == 4
+    assert frames["softirq"]["TIMER"].iloc[-1] == 100
@@ -0,0 +1,148 @@
+#!/usr/bin/env python3
+"""
+Checks the estimates of quantile_sketch.py against NumPy and SciPy on the exact values
+"""
+
+import sys
+from pathlib import Path
+
+import numpy as np
+import pytest
+from scipy import stats
+
+sys.path.insert(0, str(Path(__file__).parent.parent.resolve()))
+from quantile_sketch import DDSketch, PERCENTILES, summarize
+
+QUANTILES = [0, 0.001, 0.01, 0.1, 0.25, 0.5, 0.75, 0.9, 0.99, 0.999, 1]
+RELATIVE_ACCURACIES = [0.01, 0.05]
+
+
+def lognormal(rng, n):
+    return rng.lognormal(2, 1.5, n)
+
+
+def uniform(rng, n):
+    return rng.uniform(0, 100, n)
+
+
+def pareto(rng, n):
+    return (rng.pareto(1.5, n) + 1) * 10
+
+
+def signed(rng, n):
+    # Negatives, exact zeros and positives spanning several orders of magnitude
+    values = rng.lognormal(0, 2, n) * rng.choice([-1, 1], n)
+    values[rng.random(n) < 0.1] = 0
+    return values
+
+
+DISTRIBUTIONS = [lognormal, uniform, pareto, signed]
+
+
+def error_bound(values, q, relative_accuracy):
+    """
+    Largest error of an estimate of quantile q interpolated between bucket values each
+    within relative_accuracy of the values whose ranks surround the quantile's
+    """
+    ordered = np.sort(values)
+    rank = q * (len(ordered) - 1)
+    below = int(np.floor(rank))
+    above = min(below + 1, len(ordered) - 1)
+    frac = rank - below
+    return relative_accuracy * ((1 - frac) * abs(ordered[below]) + frac * abs(ordered[above]))
+
+
+@pytest.mark.parametrize("relative_accuracy", RELATIVE_ACCURACIES)
+@pytest.mark.parametrize("distribution", DISTRIBUTIONS)
+def test_quantiles_are_within_the_relative_accuracy(distribution, relative_accuracy):
+    values = distribution(np.random.default_rng(0), 20000)
+    sketch = DDSketch(relative_accuracy)
+    sketch.add(values)
+
+    for q in QUANTILES:
+        exact = np.percentile(values, 100 * q)
+        bound = error_bound(values, q, relative_accuracy)
+        assert abs(sketch.quantile(q) - exact) <= bound * (1 + 1e-9), q
+    assert sketch.quantile(0) == values.min()
+    assert sketch.quantile(1) == values.max()
+
+
+@pytest.mark.parametrize("distribution", DISTRIBUTIONS)
+def test_merge_matches_one_sketch(distribution):
+    values = distribution(np.random.default_rng(1), 20000)
+    whole = DDSketch()
+    whole.add(values)
+
+    merged = DDSketch()
+    for part in np.array_split(values, 7):
+        sketch = DDSketch()
+        sketch.add(part)
+        merged.merge(sketch)
+
+    assert len(merged) == len(values)
+    for q in QUANTILES:
+        assert merged.quantile(q) == whole.quantile(q), q
+    np.testing.assert_allclose(merged.log_std(), whole.log_std(), rtol=1e-9)
+
+
+def test_merge_needs_the_same_accuracy():
+    with pytest.raises(ValueError):
+        DDSketch(0.01).merge(DDSketch(0.05))
+
+
+@pytest.mark.parametrize("distribution", [lognormal, uniform, pareto])
+def test_geomean_and_log_std(distribution):
+    values = distribution(np.random.default_rng(2), 20000)
+    sketch = DDSketch()
+    sketch.add(values)
+
+    np.testing.assert_allclose(sketch.geomean(), stats.gmean(values), rtol=1e-9)
+    np.testing.assert_allclose(sketch.log_std(), np.std(np.log(values), ddof=1), rtol=1e-9)
+
+
+def test_geomean_with_zeros_and_negatives():
+    values = pareto(np.random.default_rng(3), 1000)
+    sketch = DDSketch()
+    sketch.add(values)
+
+    # Like scipy.stats.gmean, a zero makes the geomean zero and a negative value nan
+    with np.errstate(divide="ignore"):
+        sketch.add([0.0])
+        assert sketch.geomean() == stats.gmean(np.append(values, 0.0)) == 0.0
+    with np.errstate(invalid="ignore"):
+        sketch.add([-1.0])
+        assert np.isnan(sketch.geomean()) and np.isnan(stats.gmean(np.append(values, [0.0, -1.0])))
+
+    # The spread of the logs only counts the positive values
+    np.testing.assert_allclose(sketch.log_std(), np.std(np.log(values), ddof=1), rtol=1e-9)
+
+
+def test_adding_after_a_lookup():
+    values = lognormal(np.random.default_rng(4), 2000)
+    sketch = DDSketch()
+    sketch.add(values[:1000])
+    first = sketch.quantile(0.5)
+    sketch.add(values[1000:])
+
+    whole = DDSketch()
+    whole.add(values)
+    assert first != sketch.quantile(0.5) == whole.quantile(0.5)
+
+
+def test_summarize():
+    values = lognormal(np.random.default_rng(5), 5000)
+    sketch = DDSketch()
+    sketch.add(values)
+
+    summary = summarize(sketch)
+    assert set(summary) == {"geomean"} | set(PERCENTILES)
+    for name, percentile in PERCENTILES.items():
+        assert summary[name] == sketch.quantile(percentile / 100.0)
+
+
+def test_empty_sketch():
+    sketch = DDSketch()
+    sketch.add([np.nan, np.inf])
+    assert len(sketch) == 0
+    assert np.isnan(sketch.quantile(0.5))
+    assert np.isnan(sketch.geomean())
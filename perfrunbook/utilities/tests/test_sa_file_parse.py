@@ -0,0 +1,101 @@
+#!/usr/bin/env python3
+"""
+Checks the frames sa_file_parse decodes out of sadc data files against the frames
+sar_parse builds out of the `sar -f` text output of the same files.
+
+Captured fixtures are pairs of files in tests/fixtures: saNN.dat, a sadc data file, and
+saNN.txt, the output of `sar -A -f saNN.dat` with S_TIME_FORMAT=ISO.  Record a new pair
+on a host with sysstat installed with:
+
+    python3 tests/test_sa_file_parse.py --record tests/fixtures/sa<sysstat version>
+"""
+
+import argparse
+import io
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+import pytest
+
+sys.path.insert(0, str(Path(__file__).parent.parent.resolve()))
+from sa_file_parse import parse_sa_file
+from sar_parse import ParseCpuTime, ParseCSwitchTime, ParseTcpTime, SectionDispatcher, parse_start_date
+
+FIXTURES = Path(__file__).parent / "fixtures"
+SAR_ENV = dict(os.environ, S_TIME_FORMAT="ISO", LC_TIME="ISO")
+# Sections compared and the columns identifying a row within one sample
+SECTIONS = {ParseCpuTime: ["cpu"], ParseCSwitchTime: [], ParseTcpTime: []}
+# sar prints two decimals
+TOLERANCE = 0.01
+
+
+def sar_text(path):
+    res = subprocess.run(["sar", "-A", "-f", str(path)], env=SAR_ENV, check=True,
+                         stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+    return res.stdout.decode("utf-8")
+
+
+def record(path, count=5):
+    """
+    Captures count one second samples with sar into path.dat and its text into path.txt
+    """
+    dat = Path(str(path) + ".dat")
+    subprocess.run(["sar", "-o", str(dat), "1", str(count)], env=SAR_ENV, check=True,
+                   stdout=subprocess.DEVNULL, stderr=subprocess.STDOUT)
+    Path(str(path) + ".txt").write_text(sar_text(dat))
+
+
+def text_frames(text):
+    buf = io.StringIO(text)
+    start_date = parse_start_date(buf.readline())
+    parsers = [cls(start_date) for cls in SECTIONS]
+    dispatcher = SectionDispatcher(parsers)
+    dispatcher.parse(buf)
+    return dispatcher.finish(save_parquet=False)
+
+
+def assert_frames_match(dat, text):
+    decoded = parse_sa_file(str(dat), save_parquet=False)
+    rendered = text_frames(text)
+    for cls, keys in SECTIONS.items():
+        name = cls.name
+        assert name in decoded, f"{dat} has no {name} section"
+        left = decoded[name].reset_index().set_index(["time"] + keys).sort_index()
+        right = rendered[name].reset_index().set_index(["time"] + keys).sort_index()
+        assert left.index.equals(right.index), name
+
+        # Some columns are kept as the text sar printed, compare them as numbers too
+        assert len(right.columns), name
+        for column in right.columns:
+            np.testing.assert_allclose(pd.to_numeric(left[column]).to_numpy(dtype=np.float64),
+                                       pd.to_numeric(right[column]).to_numpy(dtype=np.float64),
+                                       rtol=0, atol=TOLERANCE, err_msg=f"{name} {column}")
+
+
+@pytest.mark.parametrize("dat", sorted(dat for dat in FIXTURES.glob("sa*.dat") if dat.with_suffix(".txt").exists()),
+                         ids=lambda dat: dat.stem)
+def test_fixture_matches_sar_text(dat):
+    assert_frames_match(dat, dat.with_suffix(".txt").read_text())
+
+
+@pytest.mark.skipif(shutil.which("sar") is None, reason="sysstat is not installed")
+def test_capture_matches_sar_text():
+    with tempfile.TemporaryDirectory() as tmp:
+        path = Path(tmp) / "sa"
+        record(path, count=3)
+        assert_frames_match(path.with_suffix(".dat"), path.with_suffix(".txt").read_text())
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--record", type=str, required=True,
+                        help="Path without suffix of the .dat and .txt fixture pair to capture")
+    parser.add_argument("--count", type=int, default=5, help="Number of one second samples to capture")
+    args = parser.parse_args()
+    record(args.record, args.count)
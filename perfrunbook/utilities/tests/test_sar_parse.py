@@ -0,0 +1,54 @@
+#!/usr/bin/env python3
+"""
+Checks streaming sar_parse.py output against a whole file parse
+"""
+
+import sys
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+import pytest
+
+sys.path.insert(0, str(Path(__file__).parent.parent.resolve()))
+import sar_parse
+
+CPU_HEADER = "CPU      %usr     %nice      %sys   %iowait    %steal      %irq     %soft    %guest    %gnice     %idle"
+
+
+def sar_text(ncpu, restart_cpus):
+    """
+    A CPU section of ncpu CPUs, then, as after a sysstat restart, one whose header prints an
+    extra column for restart_cpus CPUs with other names
+    """
+    lines = ["Linux 6.1.0 (ip-10-0-0-1) \t2024-03-01 \t_aarch64_\t(4 CPU)", ""]
+    for second in range(1, 4):
+        lines.append(f"12:00:0{second - 1}        {CPU_HEADER}")
+        for cpu in ["all"] + [str(cpu) for cpu in range(ncpu)]:
+            lines.append(f"12:00:0{second}  {cpu:>9} " + " ".join(f"{second + i:>9.2f}" for i in range(10)))
+        lines.append("")
+    for second in range(5, 8):
+        lines.append(f"12:00:0{second - 1}        {CPU_HEADER}    %extra")
+        for cpu in range(restart_cpus):
+            lines.append(f"12:00:0{second}  cpu{cpu:03d} " + " ".join(f"{second + i:>9.2f}" for i in range(11)))
+        lines.append("")
+    return "\n".join(lines) + "\n"
+
+
+@pytest.mark.parametrize("compact", [False, True])
+def test_streaming_survives_a_layout_change(tmp_path, monkeypatch, compact):
+    monkeypatch.chdir(tmp_path)
+    # More CPU names after the restart than an 8 bit dictionary index holds
+    Path("sar.txt").write_text(sar_text(4, 300))
+
+    sar_parse.parse_sysstat("sar.txt", chunk_rows=7, compact=compact)
+    streamed = pd.read_parquet("sar_cpu.parquet")
+    Path("sar_cpu.parquet").unlink()
+    sar_parse.parse_sysstat("sar.txt", compact=compact)
+    whole = pd.read_parquet("sar_cpu.parquet")[streamed.columns]
+
+    assert len(streamed) == 3 * 5 + 3 * 300
+    assert (streamed.index == whole.index).all()
+    assert (streamed["cpu"].astype(str).to_numpy() == whole["cpu"].astype(str).to_numpy()).all()
+    metrics = [name for name in streamed.columns if name != "cpu"]
+    np.testing.assert_allclose(streamed[metrics].to_numpy(np.float64), whole[metrics].to_numpy(np.float64))